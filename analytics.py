@@ -0,0 +1,271 @@
+"""Computations shared by the dashboard and the reports"""
+
+import collections
+import itertools
+import logging
+import re
+
+import emoji
+import numpy as np
+import pandas as pd
+
+import sketch
+
+LOGGER = logging.getLogger(__name__)
+
+EMOJI_SET = set(emoji.UNICODE_EMOJI)
+PUNCTUATION = re.compile("[.,;:!?]")
+METRICS = ["messages", "words", "characters"]
+DAYS_OF_WEEK = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+
+def add_metrics(messages):
+    """Add the number of messages, words and characters of each message's
+    body as columns."""
+    body = messages["body"].fillna("")
+    messages["messages"] = (body != "").astype(int)
+    messages["words"] = body.str.split().str.len()
+    messages["characters"] = body.str.len()
+
+    return messages
+
+
+def add_reductions(messages):
+    """Add the time of day (in hours) and the day of the week (0 being
+    Monday) of each message as columns."""
+    sent_at = messages["sent_at"].dt
+    messages["time_of_day"] = sent_at.hour + sent_at.minute / 60 + sent_at.second / 3600
+    messages["day_of_week"] = sent_at.weekday
+
+    return messages
+
+
+def split_messages(messages):
+    """Split the messages into incoming and outgoing messages."""
+    return (messages.query("type == 'incoming'"), messages.query("type == 'outgoing'"))
+
+
+def message_emoji(body):
+    """List the emoji within a message's body."""
+    return [l for l in body if l in EMOJI_SET] if isinstance(body, str) else []
+
+
+def message_ngrams(body, n):
+    """List the n-grams within a message's body.
+
+    The body is lowercased, and n-grams do not cross punctuation.
+    """
+    body = body.lower().replace("’", "'") if isinstance(body, str) else ""
+
+    grams = []
+    for segment in PUNCTUATION.split(body):
+        words = segment.split()
+        grams.extend(" ".join(words[i : i + n]) for i in range(len(words) - n + 1))
+    return grams
+
+
+def count_frame(counters, mode, top=None):
+    """Combine the counters of each direction into the result of
+    `count_items`.
+
+    If `top` is given, only the items among the `top` most common of either
+    direction are included, which is much cheaper on a large vocabulary.
+    """
+    approximate = mode == "approximate"
+    counts = {d: c.counts if approximate else c for d, c in counters.items()}
+    if top is not None:
+        items = set()
+        for c in counters.values():
+            items.update(item for item, *_ in c.most_common(top))
+        counts = {
+            d: {item: c[item] for item in items if item in c} for d, c in counts.items()
+        }
+
+    data = pd.concat(
+        {d: pd.Series(c, dtype=float) for d, c in counts.items()},
+        axis=1,
+        sort=False,
+    )
+
+    bound = 0
+    if approximate:
+        for direction, s in counters.items():
+            monitored = data[direction].notna()
+            data[f"{direction}_minus"] = pd.Series(s.errors, dtype=float)
+            data[f"{direction}_plus"] = np.where(monitored, 0, s.min_count)
+        bound = max(s.min_count for s in counters.values())
+
+    data.fillna(0, inplace=True)
+    data["total"] = data["incoming"] + data["outgoing"]
+    data.sort_values(by="total", inplace=True, ascending=False)
+
+    return data, bound
+
+
+def _counters(mode, capacity):
+    """Create the counters of each direction for `count_items`."""
+    if mode == "approximate":
+        return {d: sketch.SpaceSaving(capacity) for d in ["incoming", "outgoing"]}
+    return {d: collections.Counter() for d in ["incoming", "outgoing"]}
+
+
+def iter_count_items(incoming, outgoing, extract, mode, capacity, chunks=10):
+    """Count the items extracted from the body of the incoming and outgoing
+    messages progressively.
+
+    The messages of each direction are processed in `chunks` chunks, and
+    after each chunk a `(progress, counters)` tuple is yielded where
+    `progress` is the fraction of messages processed so far.  The counters
+    are updated in place and can be turned into the result of `count_items`
+    with `count_frame`, which should only be done when needed as it is
+    costly on a large vocabulary.
+    """
+    counters = _counters(mode, capacity)
+
+    total = len(incoming.index) + len(outgoing.index)
+    processed = 0
+    for direction, messages in [("incoming", incoming), ("outgoing", outgoing)]:
+        bodies = messages["body"]
+        size = max(1, -(-len(bodies) // chunks))
+        for i in range(0, len(bodies), size):
+            chunk = bodies.iloc[i : i + size]
+            items = itertools.chain.from_iterable(map(extract, chunk))
+            counters[direction].update(items)
+            processed += len(chunk)
+            yield processed / total, counters
+
+    if total == 0:
+        yield 1.0, counters
+
+
+def count_items(incoming, outgoing, extract, mode, capacity):
+    """Count the items extracted from the body of the incoming and outgoing
+    messages.
+
+    If `mode` is `"approximate"`, the counts are obtained from a Space-Saving
+    sketch which monitors at most `capacity` items in each direction.  The
+    sketch overestimates the count of the monitored items by up to the
+    `*_minus` columns, while items which are not monitored have a count of 0
+    but may have occurred up to `*_plus` times.
+
+    The result is indexed by item and sorted by the total count, along with
+    the largest possible error on any count.
+    """
+    counters = _counters(mode, capacity)
+    for direction, messages in [("incoming", incoming), ("outgoing", outgoing)]:
+        items = itertools.chain.from_iterable(map(extract, messages["body"]))
+        counters[direction].update(items)
+
+    return count_frame(counters, mode)
+
+
+def timeline(messages):
+    """Sum the metrics of the messages for each day and direction.
+
+    The messages must have had their metrics added with `add_metrics`.
+    """
+    date = messages["sent_at"].dt.floor("D").rename("date")
+    return messages.groupby([date, "type"])[METRICS].sum().reset_index()
+
+
+def histogram(messages, reduction):
+    """Sum the metrics of the messages for each hour of the day or day of the
+    week and direction.
+
+    The messages must have had their metrics added with `add_metrics`.
+    """
+    if reduction == "time_of_day":
+        key = messages["sent_at"].dt.hour.rename("hour")
+    elif reduction == "day_of_week":
+        key = messages["sent_at"].dt.weekday.rename("day_of_week")
+    else:
+        raise ValueError(f"Unknown reduction '{reduction}'")
+
+    return messages.groupby([key, "type"])[METRICS].sum().reset_index()
+
+
+def conversation_starters(messages, threshold):
+    """Count how many conversations were started by each direction.
+
+    A new conversation starts whenever no message has been sent for at least
+    `threshold` hours.  The messages must be sorted by `sent_at`.
+    """
+    gaps = messages["sent_at"].diff() >= pd.Timedelta(hours=threshold)
+    if len(gaps.index):
+        gaps.iloc[0] = True
+
+    return messages.loc[gaps, "type"].value_counts()
+
+
+def add_members(messages, own_label="Me"):
+    """Add the sender of each message as the `member` column, attributing
+    outgoing messages to `own_label`."""
+    member = messages["source"].astype(object)
+    member = member.where(messages["type"] != "outgoing", own_label)
+    messages["member"] = member.fillna("Unknown")
+
+    return messages
+
+
+def member_activity(messages):
+    """Sum the metrics of each member's messages for each hour of the week.
+
+    This is a single grouped aggregation over the messages, from which the
+    totals and the histograms of each member are obtained by summing over
+    the day of the week and/or the hour.  The messages must have had their
+    metrics and members added with `add_metrics` and `add_members`.
+    """
+    sent_at = messages["sent_at"].dt
+    keys = [
+        messages["member"],
+        sent_at.weekday.rename("day_of_week"),
+        sent_at.hour.rename("hour"),
+    ]
+
+    return messages.groupby(keys)[METRICS].sum()
+
+
+def iter_member_items(messages, extract, chunks=10):
+    """Count the items extracted from the body of each member's messages
+    progressively.
+
+    The messages are processed in `chunks` chunks, and after each chunk a
+    `(progress, counts)` tuple is yielded where `progress` is the fraction of
+    messages processed so far.  The counts of each `(member, item)` pair are
+    updated in place and can be turned into a series with `member_counts`.
+    The messages must have had their members added with `add_members`.
+    """
+    counts = collections.Counter()
+
+    total = len(messages.index)
+    size = max(1, -(-total // chunks))
+    for i in range(0, total, size):
+        chunk = messages.iloc[i : i + size]
+        counts.update(
+            (member, item)
+            for member, body in zip(chunk["member"], chunk["body"])
+            for item in extract(body)
+        )
+        yield (i + len(chunk.index)) / total, counts
+
+    if total == 0:
+        yield 1.0, counts
+
+
+def member_counts(counts):
+    """Convert the counts from `iter_member_items` into a series indexed by
+    member and item."""
+    if counts:
+        index = pd.MultiIndex.from_tuples(list(counts), names=["member", "item"])
+    else:
+        index = pd.MultiIndex.from_arrays([[], []], names=["member", "item"])
+
+    return pd.Series(list(counts.values()), index=index, dtype=int)
@@ -2,9 +2,10 @@
 
 import json
 import logging
+import sqlite3
 import subprocess
-from datetime import datetime
 
+import click
 import pandas as pd
 from pysqlcipher3 import dbapi2 as sqlite
 
@@ -13,6 +14,76 @@ import utilities
 
 LOGGER = logging.getLogger(__name__)
 
+MESSAGE_COLUMNS = [
+    "id",
+    "conversation_id",
+    "sent_at",
+    "received_at",
+    "source",
+    "has_attachments",
+    "type",
+    "body",
+    "json",
+]
+
+ATTACHMENT_COLUMNS = [
+    "message_id",
+    "conversation_id",
+    "type",
+    "sent_at",
+    "content_type",
+    "size",
+    "path",
+    "file_name",
+]
+
+# Schema of the local analytics database.  The tables mirror the columns of
+# Signal's own tables so that the same queries work against either backend.
+SIDECAR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id BLOB PRIMARY KEY,
+    type TEXT,
+    name TEXT,
+    profileName TEXT,
+    members TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    conversationId BLOB,
+    sent_at INTEGER,
+    received_at INTEGER,
+    expires_at INTEGER,
+    source TEXT,
+    hasAttachments INTEGER,
+    type TEXT,
+    body TEXT,
+    json TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_conversation_sent_at
+    ON messages (conversationId, sent_at);
+CREATE INDEX IF NOT EXISTS messages_type ON messages (type);
+CREATE INDEX IF NOT EXISTS messages_source ON messages (source);
+CREATE INDEX IF NOT EXISTS messages_received_at ON messages (received_at);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT,
+    position INTEGER,
+    contentType TEXT,
+    size INTEGER,
+    path TEXT,
+    fileName TEXT,
+    PRIMARY KEY (message_id, position)
+);
+CREATE TABLE IF NOT EXISTS daily (
+    conversationId BLOB,
+    date TEXT,
+    type TEXT,
+    expiring INTEGER,
+    messages INTEGER,
+    characters INTEGER,
+    PRIMARY KEY (conversationId, date, type, expiring)
+);
+"""
+
 
 def get_key(config):
     """Obtain the key from the Signal configuration."""
@@ -23,19 +94,70 @@ def get_key(config):
         return key
 
 
-def fetch(config, cmd):
-    """Connect to the Signal database and return a cursor."""
-    conn = sqlite.connect(str(config["signal_dir"] / "sql" / "db.sqlite"))
+def database_path(config):
+    """Path to the database used by the configured backend."""
+    if config["backend"] == "sidecar":
+        return config["sidecar_path"]
+    return config["signal_dir"] / "sql" / "db.sqlite"
+
+
+def connect_sidecar(config, create=False):
+    """Connect to the local analytics database.
+
+    If `create` is True, the database and its tables are created if needed,
+    and the database is made readable by its owner only as it holds copies
+    of the messages.  Otherwise, the database must have been created by the
+    `sync` command.
+    """
+    path = config["sidecar_path"]
+    if create:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        path.touch(mode=0o600)
+        path.chmod(0o600)
+    elif not path.is_file():
+        raise click.ClickException(
+            f"The analytics database '{path}' does not exist, "
+            "run `signal-tools sync` first."
+        )
+
+    conn = sqlite3.connect(str(path))
+    conn.row_factory = sqlite3.Row
+    if create:
+        conn.executescript(SIDECAR_SCHEMA)
+    LOGGER.debug(f"Connected to {config['sidecar_path']}")
+
+    return conn
+
+
+def connect(config):
+    """Connect to the database of the configured backend.
+
+    The `"signal"` backend is Signal's own encrypted database, while the
+    `"sidecar"` backend is the local analytics database populated by the
+    `sync` command.
+    """
+    if config["backend"] == "sidecar":
+        return connect_sidecar(config)
+
+    conn = sqlite.connect(str(database_path(config)))
     conn.row_factory = sqlite.Row
-    LOGGER.debug(f"Connected to {config['signal_dir'] / 'sql' / 'db.sqlite'}")
+    LOGGER.debug(f"Connected to {database_path(config)}")
 
-    try:
-        c = conn.cursor()
+    c = conn.cursor()
+    c.execute(f"PRAGMA key=\"x'{get_key(config)}'\"")
+    for setting, value in settings.SQLCIPHER_SETTINGS.items():
+        c.execute(f"PRAGMA {setting}={value}")
 
-        c.execute(f"PRAGMA key=\"x'{get_key(config)}'\"")
-        for setting, value in settings.SQLCIPHER_SETTINGS.items():
-            c.execute(f"PRAGMA {setting}={value}")
+    return conn
+
+
+def fetch(config, cmd):
+    """Connect to the database and return the rows resulting from the
+    command."""
+    conn = connect(config)
 
+    try:
+        c = conn.cursor()
         c.execute(cmd)
         rows = c.fetchall()
         LOGGER.debug(f"Fetched {len(rows)} rows")
@@ -55,9 +177,9 @@ def fetch_conversations(config, conv_type=None):
     if conv_type is None:
         type_selection = ""
     elif conv_type in ["private", "group"]:
-        type_selection = f'WHERE type = "{type}"'
+        type_selection = f'WHERE type = "{conv_type}"'
     else:
-        raise ValueError(f"Unknown conversation type '{type}'")
+        raise ValueError(f"Unknown conversation type '{conv_type}'")
 
     rows = fetch(
         config,
@@ -74,12 +196,20 @@ def fetch_conversations(config, conv_type=None):
     return rows
 
 
-def fetch_messages(config, with_attachments=None, as_dataframe=True):
+def fetch_messages(
+    config, with_attachments=None, as_dataframe=True, since=None, with_json=True
+):
     """Fetch all the messages from the database.
 
     If `with_attachments` is not None, then only those messages with
     attachments will be returned.
 
+    If `since` is not None, only those messages received after that time
+    (given as a datetime) will be returned.
+
+    If `with_json` is False, the raw JSON of the messages is neither fetched
+    nor parsed.
+
     If `as_dataframe` is True, the data will be loaded and processed into a
     Pandas DataFrame
     """
@@ -88,6 +218,9 @@ def fetch_messages(config, with_attachments=None, as_dataframe=True):
         cond.append("expires_at is null")
     if with_attachments is not None:
         cond.append("has_attachments = 1")
+    if since is not None:
+        cond.append(f"received_at > {utilities.to_milliseconds(since)}")
+    columns = MESSAGE_COLUMNS if with_json else MESSAGE_COLUMNS[:-1]
     rows = fetch(
         config,
         f"""
@@ -99,8 +232,8 @@ def fetch_messages(config, with_attachments=None, as_dataframe=True):
             source,
             hasAttachments has_attachments,
             type,
-            body,
-            json
+            body
+            {', json' if with_json else ''}
         FROM messages
         WHERE {' and '.join(cond)}
         ORDER BY sent_at ASC""",
@@ -109,18 +242,124 @@ def fetch_messages(config, with_attachments=None, as_dataframe=True):
     if not as_dataframe:
         return rows
 
-    rows = pd.DataFrame(rows, columns=rows[0].keys(), dtype=object)
+    rows = pd.DataFrame(rows, columns=columns, dtype=object)
 
-    rows["sent_at"] = rows["sent_at"].apply(lambda x: datetime.fromtimestamp(x / 1000))
-    rows["received_at"] = rows["received_at"].apply(
-        lambda x: datetime.fromtimestamp(x / 1000)
-    )
-    rows["has_attachments"] = rows["has_attachments"].apply(bool)
-    rows["json"] = rows["json"].apply(utilities.parse_message_json)
+    rows["sent_at"] = utilities.to_datetime(rows["sent_at"])
+    rows["received_at"] = utilities.to_datetime(rows["received_at"])
+    rows["has_attachments"] = rows["has_attachments"].astype(bool)
+    if with_json:
+        rows["json"] = utilities.parse_messages_json(
+            rows["json"], workers=config.get("workers")
+        )
 
     return rows
 
 
+def fetch_attachments(config, since=None):
+    """Fetch the index of the attachments of all the messages.
+
+    Each attachment is listed with its message's ID, conversation, type and
+    time along with its content type, size, path and file name.  With the
+    sidecar backend, the index is read from the attachments table populated
+    by the `sync` command.  Otherwise, it is built from the JSON of the
+    messages which have attachments.
+
+    If `since` is not None, only the attachments of the messages received
+    after that time (given as a datetime) will be returned.
+    """
+    cond = []
+    if not config["include_expiring"]:
+        cond.append("m.expires_at is null")
+    if since is not None:
+        cond.append(f"m.received_at > {utilities.to_milliseconds(since)}")
+
+    if config["backend"] == "sidecar":
+        rows = fetch(
+            config,
+            f"""
+            SELECT
+                a.message_id,
+                cast(m.conversationId AS BLOB) conversation_id,
+                m.type,
+                m.sent_at,
+                a.contentType content_type,
+                a.size,
+                a.path,
+                a.fileName file_name
+            FROM attachments a
+            JOIN messages m ON a.message_id = m.id
+            {'WHERE ' + ' and '.join(cond) if cond else ''}
+            ORDER BY m.sent_at ASC, a.position ASC""",
+        )
+        records = [tuple(row) for row in rows]
+    else:
+        cond.append("m.hasAttachments = 1")
+        rows = fetch(
+            config,
+            f"""
+            SELECT
+                m.id,
+                cast(m.conversationId AS BLOB) conversation_id,
+                m.type,
+                m.sent_at,
+                m.json
+            FROM messages m
+            WHERE {' and '.join(cond)}
+            ORDER BY m.sent_at ASC""",
+        )
+        attachments = utilities.parse_attachments(
+            (row["json"] for row in rows), workers=config.get("workers")
+        )
+        records = [
+            (
+                row["id"],
+                row["conversation_id"],
+                row["type"],
+                row["sent_at"],
+                a.get("contentType"),
+                a.get("size"),
+                a.get("path"),
+                a.get("fileName"),
+            )
+            for row, atts in zip(rows, attachments)
+            for a in atts
+        ]
+
+    attachments = pd.DataFrame(records, columns=ATTACHMENT_COLUMNS)
+    attachments["sent_at"] = utilities.to_datetime(attachments["sent_at"])
+    attachments["size"] = attachments["size"].fillna(0).astype("int64")
+
+    return attachments
+
+
+def fetch_message_counts(config):
+    """Count the messages in each conversation.
+
+    With the sidecar backend, the counts are obtained from the daily
+    aggregates.
+    """
+    if config["backend"] == "sidecar":
+        cond = "" if config["include_expiring"] else "WHERE expiring = 0"
+        cmd = f"""
+        SELECT
+            cast(conversationId AS BLOB) conversation_id,
+            sum(messages) count
+        FROM daily
+        {cond}
+        GROUP BY conversationId"""
+    else:
+        cond = "" if config["include_expiring"] else "WHERE expires_at is null"
+        cmd = f"""
+        SELECT
+            cast(conversationId AS BLOB) conversation_id,
+            count(*) count
+        FROM messages
+        {cond}
+        GROUP BY conversationId"""
+
+    return {row["conversation_id"]: row["count"] for row in fetch(config, cmd)}
+
+
 def dump_messages(config, output_dir):
     """Connect to the Signal database and return a cursor."""
 
@@ -135,12 +374,14 @@ def dump_messages(config, output_dir):
         "messages_fts_idx",
     ]
 
-    sql = f"PRAGMA key=\"x'{get_key(config)}'\";\n"
-    for setting, value in settings.SQLCIPHER_SETTINGS.items():
-        sql += f"PRAGMA {setting}={value};\n"
+    sql = ""
+    if config["backend"] != "sidecar":
+        sql += f"PRAGMA key=\"x'{get_key(config)}'\";\n"
+        for setting, value in settings.SQLCIPHER_SETTINGS.items():
+            sql += f"PRAGMA {setting}={value};\n"
     sql += f".out {output_dir / 'messages.sql'};\n"
     sql += ".headers on;\n"
     sql += f".dump {' '.join(tables)};\n"
     print(sql)
 
-    subprocess.run(["sqlite3", config["signal_dir"] / "sql" / "db.sqlite", sql])
+    subprocess.run(["sqlite3", database_path(config), sql])
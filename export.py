@@ -4,15 +4,58 @@ from pathlib import Path
 import click
 
 import db
+import profiles
 import utilities
 
 LOGGER = logging.getLogger(__name__)
 
 
+def export(config, fmt, export_attachments):
+    """Export all conversations of a profile into its output directory.
+
+    Returns a summary of the number of conversations and messages exported,
+    or of the dump file for the SQL format.
+    """
+    output_dir = config["output_dir"]
+    LOGGER.info(f"Export all conversations into '{output_dir}'.")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if fmt == "sql":
+        db.dump_messages(config, output_dir)
+        return {"dump": str(output_dir / "messages.sql")}
+
+    messages = db.fetch_messages(config, as_dataframe=True)
+
+    for col in messages.columns:
+        LOGGER.debug(f"Column '{col}' type: {messages[col].dtype}")
+
+    conv_map = utilities.conversation_mapping(config)
+
+    for c_id, c_name in conv_map.items():
+        LOGGER.info(f"Exporting conversation '{c_name}'")
+        conv_dir = output_dir / c_name
+        conv_dir.mkdir(exist_ok=True)
+        if fmt == "csv":
+            messages[messages["conversation_id"] == c_id].to_csv(
+                conv_dir / "messages.csv", index=False
+            )
+        elif fmt == "json":
+            messages[messages["conversation_id"] == c_id].to_json(
+                conv_dir / "messages.json", orient="records"
+            )
+
+    if export_attachments:
+        utilities.export_attachments(config, db.fetch_attachments(config))
+
+    return {"conversations": len(conv_map), "messages": len(messages.index)}
+
+
 @click.command(__name__.replace("_", "-"))
 @click.option(
     "-f",
     "--format",
+    "fmt",
     type=click.Choice(["csv", "sql", "json"]),
     default="csv",
     help="Set the output format.",
@@ -34,34 +77,7 @@ LOGGER = logging.getLogger(__name__)
 def main(ctx, fmt, output_dir, export_attachments):
     """Export all conversations.
     """
-    LOGGER.info("Export all conversations into '{output_dir}'.")
-
-    output_dir = Path(output_dir)
-    output_dir.mkdir(exist_ok=True)
-
-    if fmt == "sql":
-        db.dump_messages(ctx.obj["config"], output_dir)
-        return
-
-    messages = db.fetch_messages(ctx.obj["config"], as_dataframe=True)
-
-    for col in messages.columns:
-        LOGGER.debug(f"Column '{col}' type: {messages[col].dtype}")
-
-    conv_map = utilities.conversation_mapping(ctx.obj["config"])
-
-    for c_id, c_name in conv_map.items():
-        LOGGER.info(f"Exporting conversation '{c_name}'")
-        conv_dir = output_dir / c_name
-        conv_dir.mkdir(exist_ok=True)
-        if fmt == "csv":
-            messages[messages["conversation_id"] == c_id].to_csv(
-                conv_dir / "messages.csv", index=False
-            )
-        elif fmt == "json":
-            messages[messages["conversation_id"] == c_id].to_json(
-                conv_dir / "messages.json", orient="records"
-            )
-
-    if export_attachments:
-        utilities.export_attachments(ctx.obj["config"], messages)
+    results = profiles.run(
+        ctx, export, fmt, export_attachments, output_dir=Path(output_dir)
+    )
+    profiles.print_summary(results)
@@ -0,0 +1,162 @@
+"""Background jobs for long-running dashboard computations"""
+
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised within a job which has been superseded."""
+
+
+class Job:
+    """A computation running in the background.
+
+    The computation is called as `func(job, *args)` and should regularly
+    call `job.update` to report its progress (between 0 and 1) and,
+    whenever `job.partial_requested` is set, its partial result.  Updating a
+    job which has been cancelled raises `JobCancelled`, which stops the
+    computation.
+    """
+
+    def __init__(self, key, func, args):
+        self.key = key
+        self.progress = 0.0
+        self.partial = None
+        self.result = None
+        self.error = None
+        self._func = func
+        self._args = args
+        self._partial_requested = threading.Event()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def partial_requested(self):
+        return self._partial_requested.is_set()
+
+    def request_partial(self):
+        """Ask the computation to report its partial result at its next
+        update."""
+        self._partial_requested.set()
+
+    def cancel(self):
+        """Request the job to stop at its next update."""
+        self._cancelled.set()
+
+    def update(self, progress, partial=None):
+        """Report the progress and, optionally, the partial result of the
+        job."""
+        if self.cancelled:
+            raise JobCancelled()
+        self.progress = progress
+        if partial is not None:
+            self.partial = partial
+            self._partial_requested.clear()
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish, returning whether it has."""
+        return self._done.wait(timeout)
+
+    def run(self):
+        """Run the job; this is called by the job queue's worker threads."""
+        try:
+            if self.cancelled:
+                raise JobCancelled()
+            self.result = self._func(self, *self._args)
+            self.progress = 1.0
+        except JobCancelled:
+            LOGGER.debug(f"Job {self.key} cancelled.")
+        except Exception as e:  # pylint: disable=broad-except
+            LOGGER.exception(f"Job {self.key} failed.")
+            self.error = e
+        finally:
+            self._done.set()
+
+
+class JobQueue:
+    """Queue of jobs processed by a pool of worker threads.
+
+    Each client of each dashboard panel has at most one current job.
+    Submitting a job with a different key cancels the client's previous job
+    for that panel, so that rapid changes of the inputs do not pile up
+    redundant work, while leaving the jobs of the other clients untouched.
+    The most recently finished jobs are kept by key, so that clients asking
+    for the same computation share its result.
+    """
+
+    def __init__(self, workers=None, cache_size=16, max_clients=64):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self._jobs = collections.OrderedDict()
+        self._finished = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._max_clients = max_clients
+        self._lock = threading.Lock()
+
+    def submit(self, panel, client, key, func, *args):
+        """Submit a job for the client's panel, unless a recently finished
+        job or the client's current job has the same key in which case that
+        job is returned instead."""
+        with self._lock:
+            current = self._jobs.pop((panel, client), None)
+            job = self._finished.get((panel, key))
+            if job is not None:
+                self._finished.move_to_end((panel, key))
+            elif current is not None and current.key == key and not current.cancelled:
+                job = current
+            if current is not None and current is not job and not current.done:
+                current.cancel()
+
+            if job is None:
+                job = Job(key, func, args)
+                self._executor.submit(self._run, panel, job)
+
+            # Forget the clients which have been gone the longest, such as
+            # closed browser tabs.
+            self._jobs[(panel, client)] = job
+            while len(self._jobs) > self._max_clients:
+                _, old = self._jobs.popitem(last=False)
+                if not old.done:
+                    old.cancel()
+
+        return job
+
+    def _run(self, panel, job):
+        """Run the job, keeping it among the finished jobs if it succeeds."""
+        job.run()
+        if job.error is not None or job.cancelled:
+            return
+
+        with self._lock:
+            self._finished[(panel, job.key)] = job
+            while len(self._finished) > self._cache_size:
+                self._finished.popitem(last=False)
+
+    def cancel(self, panel, client):
+        """Cancel the client's current job for the panel, if any."""
+        with self._lock:
+            job = self._jobs.pop((panel, client), None)
+            if job is not None and not job.done:
+                job.cancel()
+
+    def cancel_all(self):
+        """Cancel the current job of every client and panel."""
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.done:
+                    job.cancel()
+            self._jobs.clear()
+            self._finished.clear()
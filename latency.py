@@ -0,0 +1,89 @@
+"""Reply latency analytics"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+PERCENTILES = [25, 50, 75, 90, 99]
+
+
+def reply_latencies(messages):
+    """Compute how long it took for each reply to be sent.
+
+    A reply is a message whose direction differs from the previous message in
+    the same conversation, and its latency is the time elapsed since that
+    previous message.  The messages are sorted by conversation and time once,
+    after which the replies are found with a single `diff` and a mask of the
+    direction changes.
+
+    The result has one row per reply with the columns `conversation_id`,
+    `type` (the direction of the reply), `sent_at` and `latency` (in
+    seconds).
+    """
+    messages = messages[messages["type"].isin(["incoming", "outgoing"])]
+    messages = messages.sort_values(["conversation_id", "sent_at"], kind="mergesort")
+
+    conversation = messages["conversation_id"].to_numpy()
+    direction = messages["type"].to_numpy()
+    sent_at = messages["sent_at"].to_numpy()
+
+    n = len(messages)
+    same_conversation = np.zeros(n, dtype=bool)
+    same_conversation[1:] = conversation[1:] == conversation[:-1]
+    direction_change = np.zeros(n, dtype=bool)
+    direction_change[1:] = direction[1:] != direction[:-1]
+    delta = np.zeros(n, dtype="timedelta64[ns]")
+    delta[1:] = np.diff(sent_at)
+
+    mask = same_conversation & direction_change
+    replies = pd.DataFrame(
+        {
+            "conversation_id": conversation[mask],
+            "type": direction[mask],
+            "sent_at": sent_at[mask],
+            "latency": delta[mask] / np.timedelta64(1, "s"),
+        }
+    )
+    LOGGER.debug(f"Found {len(replies)} replies in {n} messages")
+
+    return replies
+
+
+def percentiles(replies, q=None):
+    """Compute the percentiles of the reply latency for each direction.
+
+    The result is indexed by the percentile and has a column for each of the
+    `incoming` and `outgoing` directions.
+    """
+    if q is None:
+        q = PERCENTILES
+
+    data = pd.DataFrame(index=q, columns=["incoming", "outgoing"], dtype=float)
+    for direction, latency in replies.groupby("type")["latency"]:
+        data[direction] = np.percentile(latency, q)
+
+    return data
+
+
+def hourly_heatmap(replies, direction):
+    """Compute the median reply latency by day of the week and hour of the
+    day for the replies in the given direction.
+
+    The result is indexed by the day of week (0 being Monday), with a column
+    for each hour of the day.
+    """
+    replies = replies[replies["type"] == direction]
+    if replies.empty:
+        return pd.DataFrame(index=range(7), columns=range(24), dtype=float)
+
+    data = (
+        replies["latency"]
+        .groupby([replies["sent_at"].dt.weekday, replies["sent_at"].dt.hour])
+        .median()
+        .unstack()
+    )
+
+    return data.reindex(index=range(7), columns=range(24))
@@ -7,39 +7,40 @@ import click
 from termcolor import colored
 
 import db
+import profiles
+import utilities
 
 LOGGER = logging.getLogger(__name__)
 
 
-@click.command(__name__.replace("_", "-"))
-@click.option(
-    "--show-id/--hide-id",
-    "show_id",
-    default=False,
-    help=(
-        "Toggle the display conversation ID. For group conversation, the ID is"
-        "base64 encoded."
-    ),
-)
-@click.option(
-    "--show-message-count/--hide-message-count",
-    "show_message_count",
-    default=True,
-    help="Toggle the display of message counts.",
-)
-@click.pass_context
-def main(ctx, show_id, show_message_count):
-    """List all the conversations in Signal.
-    """
+def format_media(media, conv_id):
+    """Format the number and total size of a conversation's attachments."""
+    if conv_id not in media.index:
+        return colored("[no media]")
+    count, size = media.loc[conv_id, ["count", "size"]]
+    return colored(f"[{count} files, {utilities.format_size(size)}]", "cyan")
+
+
+def list_conversations(config, show_id, show_message_count, show_media):
+    """List all the conversations of a profile, returning the formatted
+    listing."""
     LOGGER.debug("Listing all conversations in the database.")
 
+    lines = []
     count = 0
 
     if show_message_count:
-        messages = db.fetch_messages(ctx.obj["config"])
+        message_counts = db.fetch_message_counts(config)
+    if show_media:
+        media = (
+            db.fetch_attachments(config)
+            .groupby("conversation_id")["size"]
+            .agg(["count", "sum"])
+            .rename(columns={"sum": "size"})
+        )
 
-    print(colored("Private conversations:", "white", attrs=["bold"]))
-    conversations = db.fetch_conversations(ctx.obj["config"], conv_type="private")
+    lines.append(colored("Private conversations:", "white", attrs=["bold"]))
+    conversations = db.fetch_conversations(config, conv_type="private")
     for conv in conversations:
         count += 1
 
@@ -51,14 +52,17 @@ def main(ctx, show_id, show_message_count):
             colored(conv["name"] if conv["name"] else conv["profile_name"], "white")
         )
         if show_message_count:
-            count = len([c for c in messages if c["conversation_id"] == conv["id"]])
-            output.append(colored(f"[{count} messages]"))
+            output.append(
+                colored(f"[{message_counts.get(conv['id'], 0)} messages]")
+            )
+        if show_media:
+            output.append(format_media(media, conv["id"]))
 
-        print(" ".join(output))
+        lines.append(" ".join(output))
 
-    print("")
-    print(colored("Group conversations:", "white", attrs=["bold"]))
-    conversations = db.fetch_conversations(ctx.obj["config"], conv_type="group")
+    lines.append("")
+    lines.append(colored("Group conversations:", "white", attrs=["bold"]))
+    conversations = db.fetch_conversations(config, conv_type="group")
     for conv in conversations:
         count += 1
 
@@ -73,10 +77,51 @@ def main(ctx, show_id, show_message_count):
         )
         output.append(f"({len(conv['members'])} members)")
         if show_message_count:
-            count = len([c for c in messages if c["conversation_id"] == conv["id"]])
-            output.append(colored(f"[{count} messages]"))
+            output.append(
+                colored(f"[{message_counts.get(conv['id'], 0)} messages]")
+            )
+        if show_media:
+            output.append(format_media(media, conv["id"]))
 
-        print(" ".join(output))
+        lines.append(" ".join(output))
+
+    lines.append("")
+    lines.append(colored(f"{count} conversations in total.", "green"))
+
+    return "\n".join(lines)
+
+
+@click.command(__name__.replace("_", "-"))
+@click.option(
+    "--show-id/--hide-id",
+    "show_id",
+    default=False,
+    help=(
+        "Toggle the display conversation ID. For group conversation, the ID is"
+        "base64 encoded."
+    ),
+)
+@click.option(
+    "--show-message-count/--hide-message-count",
+    "show_message_count",
+    default=True,
+    help="Toggle the display of message counts.",
+)
+@click.option(
+    "--media/--no-media",
+    "show_media",
+    default=False,
+    help="Toggle the display of the number and size of attachments.",
+)
+@click.pass_context
+def main(ctx, show_id, show_message_count, show_media):
+    """List all the conversations in Signal.
+    """
+    results = profiles.run(
+        ctx, list_conversations, show_id, show_message_count, show_media
+    )
 
-    print("")
-    print(colored(f"{count} conversations in total.", "green"))
+    for name, listing in results.items():
+        if len(ctx.obj["profiles"]) > 1:
+            print(colored(f"Profile {name}:", "yellow", attrs=["bold"]))
+        print(listing)
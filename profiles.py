@@ -0,0 +1,133 @@
+"""Processing of multiple Signal profiles"""
+
+import copy
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import toml
+
+import settings
+
+LOGGER = logging.getLogger(__name__)
+
+
+def sanitize_config(config: dict):
+    """Sanitize a configuration."""
+    for k, f in settings.CONFIG_SANITIZER.items():
+        config[k] = f(config[k])
+
+
+def load_manifest(path):
+    """Load the profiles listed in a manifest file.
+
+    The manifest is a TOML file with a `[[profile]]` table for each profile,
+    each of which must specify a `signal_dir` and may specify a `name` and
+    any other configuration option to be overwritten for that profile.
+    """
+    manifest = toml.load(path)
+    entries = manifest.get("profile", [])
+    for entry in entries:
+        if "signal_dir" not in entry:
+            raise ValueError(f"Profile in '{path}' does not specify a signal_dir")
+        entry["signal_dir"] = Path(path).parent / Path(entry["signal_dir"]).expanduser()
+
+    return entries
+
+
+def sidecar_path(base, signal_dir):
+    """Path of the analytics database of the profile in `signal_dir`, derived
+    from the `base` path and the resolved profile directory."""
+    signal_dir = Path(signal_dir).expanduser().resolve()
+    digest = hashlib.sha1(str(signal_dir).encode("utf-8")).hexdigest()[:8]
+    return base.with_name(f"{base.stem}-{signal_dir.name}-{digest}{base.suffix}")
+
+
+def profile_configs(base, entries):
+    """Create an isolated configuration for each profile.
+
+    Each configuration is a copy of `base` updated with the profile's entry.
+    Unless the entry specifies its `sidecar_path`, each profile gets its own
+    analytics database derived from its Signal directory, so that a profile
+    always maps to the same database.  If there are multiple profiles, each
+    is processed with a single worker, as the profiles are themselves
+    processed in parallel.
+
+    Returns a list of `(name, config)` tuples, with unique names.
+    """
+    profiles = []
+    names = set()
+    for entry in entries:
+        entry = dict(entry)
+        name = entry.pop("name", None) or Path(entry["signal_dir"]).name
+        unique, i = name, 1
+        while unique in names:
+            i += 1
+            unique = f"{name}-{i}"
+        names.add(unique)
+
+        config = copy.deepcopy(base)
+        config.update(entry)
+        sanitize_config(config)
+
+        if "sidecar_path" not in entry:
+            config["sidecar_path"] = sidecar_path(
+                config["sidecar_path"], config["signal_dir"]
+            )
+        if len(entries) > 1:
+            config["workers"] = 1
+
+        profiles.append((unique, config))
+
+    return profiles
+
+
+def run(ctx, func, *args, output_dir=None):
+    """Run `func(config, *args)` for each profile.
+
+    If `output_dir` is given, each profile's `output_dir` is set to it (or to
+    a subdirectory named after the profile if there are multiple profiles).
+    Multiple profiles are processed in parallel across a process pool, and
+    the failure of one profile does not prevent the others from being
+    processed.
+
+    Returns a dictionary of the results indexed by profile name, omitting
+    profiles which failed.
+    """
+    profiles = ctx.obj["profiles"]
+    for name, config in profiles:
+        if output_dir is not None:
+            config["output_dir"] = Path(output_dir)
+            if len(profiles) > 1:
+                config["output_dir"] = config["output_dir"] / name
+
+    if len(profiles) == 1:
+        name, config = profiles[0]
+        return {name: func(config, *args)}
+
+    LOGGER.info(f"Processing {len(profiles)} profiles.")
+    results = {}
+    with ProcessPoolExecutor(max_workers=ctx.obj["workers"]) as pool:
+        futures = {
+            name: pool.submit(func, config, *args) for name, config in profiles
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception(f"Failed to process profile '{name}'")
+
+    return results
+
+
+def print_summary(results):
+    """Print the merged summary of the results of each profile, where each
+    result is a dictionary of values."""
+    if not results:
+        return
+
+    summary = pd.DataFrame.from_dict(results, orient="index")
+    summary.index.name = "profile"
+    print(summary.to_string())
@@ -0,0 +1,224 @@
+"""Headless report command"""
+
+import html
+import importlib.util
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import pandas as pd
+
+import analytics
+import db
+import profiles
+import store
+import utilities
+
+LOGGER = logging.getLogger(__name__)
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+{sections}
+</body>
+</html>
+"""
+
+
+def analyse_conversation(messages, options):
+    """Compute all the statistics for the messages of a single conversation.
+
+    The messages must have had their metrics added with
+    `analytics.add_metrics`.
+    """
+    incoming, outgoing = analytics.split_messages(messages)
+
+    emoji, _ = analytics.count_items(
+        incoming,
+        outgoing,
+        analytics.message_emoji,
+        options["mode"],
+        options["capacity"],
+    )
+    ngrams, _ = analytics.count_items(
+        incoming,
+        outgoing,
+        lambda body: analytics.message_ngrams(body, options["ngrams"]),
+        options["mode"],
+        options["capacity"],
+    )
+    starters = analytics.conversation_starters(messages, options["starter_threshold"])
+
+    return {
+        "summary": messages.groupby("type")[analytics.METRICS].sum().reset_index(),
+        "timeline": analytics.timeline(messages),
+        "time_of_day": analytics.histogram(messages, "time_of_day"),
+        "day_of_week": analytics.histogram(messages, "day_of_week"),
+        "emoji": emoji.head(options["top"]).rename_axis("emoji").reset_index(),
+        "ngrams": ngrams.head(options["top"]).rename_axis("ngram").reset_index(),
+        "conversation_starters": starters.rename_axis("type")
+        .rename("conversations")
+        .reset_index(),
+    }
+
+
+def _analyse_conversation(args):
+    """Unpack the arguments for `analyse_conversation` from `Executor.map`."""
+    return analyse_conversation(*args)
+
+
+def write_report(output_dir, title, tables, formats, name="report"):
+    """Write the tables of a report in each of the requested formats.
+
+    The JSON and HTML outputs are written to `name.json` and `name.html`,
+    while each table is written to its own `name-table.parquet` file.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if "json" in formats:
+        with open(output_dir / f"{name}.json", "w") as f:
+            json.dump(
+                {k: v.to_dict(orient="records") for k, v in tables.items()},
+                f,
+                default=str,
+            )
+
+    if "parquet" in formats:
+        for k, v in tables.items():
+            v.to_parquet(output_dir / f"{name}-{k}.parquet", index=False)
+
+    if "html" in formats:
+        sections = "\n".join(
+            f"<h2>{k.replace('_', ' ').capitalize()}</h2>\n{v.to_html(index=False)}"
+            for k, v in tables.items()
+        )
+        with open(output_dir / f"{name}.html", "w") as f:
+            f.write(HTML_TEMPLATE.format(title=html.escape(title), sections=sections))
+
+
+def report(config, formats, options):
+    """Write a report of the statistics of all conversations of a profile
+    into its output directory.
+
+    Returns the summary of the number of messages, words and characters of
+    each conversation.
+    """
+    output_dir = config["output_dir"]
+    LOGGER.info(f"Writing a report of all conversations into '{output_dir}'.")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    conv_map = utilities.conversation_mapping(config)
+    messages = db.fetch_messages(config, as_dataframe=True, with_json=False)
+    messages = store.compact_messages(messages, conv_map)
+    messages = analytics.add_metrics(messages)
+
+    groups = {
+        c_id: m for c_id, m in messages.groupby("conversation_id", observed=True)
+    }
+    groups[None] = messages
+    args = [(m, options) for m in groups.values()]
+
+    LOGGER.info(f"Analysing {len(groups)} conversations.")
+    if config["workers"] == 1:
+        reports = list(map(_analyse_conversation, args))
+    else:
+        with ProcessPoolExecutor(max_workers=config["workers"]) as pool:
+            reports = list(pool.map(_analyse_conversation, args))
+
+    summary = []
+    for c_id, tables in zip(groups, reports):
+        if c_id is None:
+            c_name = "All conversations"
+            conv_dir = output_dir
+        else:
+            c_name = conv_map.get(c_id, c_id.decode("UTF-8"))
+            conv_dir = output_dir / c_name
+
+        LOGGER.info(f"Writing report for '{c_name}'")
+        write_report(conv_dir, c_name, tables, formats)
+
+        totals = tables["summary"].set_index("type")[analytics.METRICS]
+        summary.append({"conversation": c_name, **totals.sum().to_dict()})
+
+    return pd.DataFrame(summary)
+
+
+@click.command(__name__.replace("_", "-"))
+@click.option(
+    "-f",
+    "--format",
+    "formats",
+    type=click.Choice(["html", "json", "parquet"]),
+    multiple=True,
+    default=["html", "json"],
+    help="Set the output formats.  Can be specified multiple times.",
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    default="./report/",
+    type=click.Path(file_okay=False),
+    help="Set the report directory.",
+)
+@click.option(
+    "-n",
+    "--ngrams",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Number of words in each n-gram.",
+)
+@click.option(
+    "--top",
+    default=100,
+    type=click.IntRange(min=1),
+    help="Number of emoji and n-grams to report.",
+)
+@click.option(
+    "--starter-threshold",
+    default=2.0,
+    type=float,
+    help="Hours of inactivity after which a new conversation is started.",
+)
+@click.option(
+    "--approximate/--exact",
+    default=False,
+    help="Toggle whether emoji and n-grams are counted approximately.",
+)
+@click.pass_context
+def main(ctx, formats, output_dir, ngrams, top, starter_threshold, approximate):
+    """Write a report of the statistics of all conversations.
+    """
+    if "parquet" in formats and not any(
+        importlib.util.find_spec(engine) for engine in ["pyarrow", "fastparquet"]
+    ):
+        raise click.UsageError(
+            "The parquet format requires pyarrow or fastparquet to be installed."
+        )
+
+    output_dir = Path(output_dir)
+    options = {
+        "mode": "approximate" if approximate else "exact",
+        "capacity": ctx.obj["config"]["sketch_capacity"],
+        "ngrams": ngrams,
+        "top": top,
+        "starter_threshold": starter_threshold,
+    }
+
+    results = profiles.run(ctx, report, formats, options, output_dir=output_dir)
+    if not results:
+        return
+
+    if len(ctx.obj["profiles"]) > 1:
+        summary = pd.concat(results, names=["profile", None]).reset_index(level=0)
+    else:
+        summary = next(iter(results.values()))
+    write_report(
+        output_dir, "Summary", {"conversations": summary}, formats, name="summary"
+    )
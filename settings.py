@@ -7,6 +7,10 @@ CONFIG = {
     "signal_dir": Path.home() / ".config" / "Signal",
     "own_number": None,
     "include_expiring": False,
+    "workers": None,
+    "sketch_capacity": 1000,
+    "backend": "signal",
+    "sidecar_path": Path.home() / ".cache" / "signal-tools" / "analytics.sqlite",
 }
 
 CONFIG_SANITIZER = {
@@ -14,6 +18,10 @@ CONFIG_SANITIZER = {
     "signal_dir": Path,
     "own_number": lambda x: str(x) if x else None,
     "include_expiring": bool,
+    "workers": lambda x: int(x) if x else None,
+    "sketch_capacity": int,
+    "backend": str,
+    "sidecar_path": Path,
 }
 
 SQLCIPHER_SETTINGS = {
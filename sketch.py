@@ -0,0 +1,72 @@
+"""Approximate frequency counting with bounded memory"""
+
+import heapq
+
+
+class SpaceSaving:
+    """Approximate the most frequent items of a stream with the Space-Saving
+    algorithm of Metwally, Agrawal and El Abbadi.
+
+    At most `capacity` items are monitored at any time, so the memory used is
+    independent of the number of distinct items in the stream.  The count of
+    a monitored item is never an underestimate, and overestimates the true
+    count by at most its `errors` entry.  Any item which is not monitored
+    occurred at most `min_count` times.  Both bounds are at most
+    `total / capacity`.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # Each monitored item has exactly one entry in the heap, whose count
+        # may lag behind the item's actual count.
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item, count=1):
+        """Add an occurrence of an item to the sketch."""
+        self.total += count
+
+        if item in self.counts:
+            self.counts[item] += count
+            return
+
+        error = self._evict() if len(self.counts) >= self.capacity else 0
+        self.counts[item] = error + count
+        self.errors[item] = error
+        heapq.heappush(self._heap, (self.counts[item], item))
+
+    def update(self, items):
+        """Add all the items from an iterable to the sketch."""
+        for item in items:
+            self.add(item)
+
+    def _evict(self):
+        """Stop monitoring the item with the smallest count, returning its
+        count."""
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts[item] == count:
+                del self.counts[item]
+                del self.errors[item]
+                return count
+            heapq.heappush(self._heap, (self.counts[item], item))
+
+    @property
+    def min_count(self):
+        """Upper bound on the count of any item which is not monitored."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def most_common(self, n=None):
+        """List the `n` items with the largest counts as `(item, count,
+        error)` tuples.  All monitored items are listed if `n` is `None`."""
+        items = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        if n is not None:
+            items = items[:n]
+        return [(item, count, self.errors[item]) for item, count in items]
@@ -1,219 +1,356 @@
 """Analysis of the data"""
 
-import itertools
+import functools
 import logging
 import pickle
-import re
-import time
+import threading
+import uuid
 from datetime import timedelta
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import emoji
-import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
+import analytics
 import db
+import jobs
+import latency
+import store
 import utilities
+import watch
 
 LOGGER = logging.getLogger(__name__)
 
-EMOJI_SET = set(emoji.UNICODE_EMOJI)
-
 LOGGER.debug("Unpickling configuration")
 CONFIG = pickle.load(open(".config.pkl", "rb"))
-LAST_UPDATE = time.time()
-MESSAGES = db.fetch_messages(CONFIG, as_dataframe=True)
+DATA_LOCK = threading.Lock()
+DATA_VERSION = 0
 CONVS = utilities.conversation_mapping(CONFIG)
-
-APP = dash.Dash("signal-statistics")
-# APP.config["suppress_callback_exceptions"] = True
-APP.layout = html.Div(
-    [
-        # Header
-        html.Div(
-            [
-                html.Span("Signal Conversation Statistics", className="title"),
-                html.Div(
-                    [
-                        dcc.Dropdown(
-                            id="conversation",
-                            options=sorted(
-                                [
-                                    {"label": v, "value": k.decode("UTF-8")}
-                                    for k, v in CONVS.items()
-                                ],
-                                key=lambda o: o["label"],
-                            ),
-                        )
-                    ],
-                    className="conversation-selector",
-                ),
-            ],
-            className="header",
-        ),
-        # Content
-        html.Div(
-            [
-                # Timeline
-                html.Div(
-                    [
-                        html.H2("Conversation Timeline"),
-                        dcc.Tabs(
-                            [
-                                dcc.Tab(label="Messages", value="messages"),
-                                dcc.Tab(label="Words", value="words"),
-                                dcc.Tab(label="Characters", value="characters"),
-                            ],
-                            id="timeline-value",
-                            value="messages",
-                        ),
-                        dcc.Loading(dcc.Graph(id="timeline-figure")),
-                    ],
-                    className="timeline",
-                ),
-                # Histogram
-                html.Div(
-                    [
-                        html.H2("Histogram"),
-                        html.Div(
-                            [
-                                dcc.Dropdown(
-                                    id="histogram-reduction",
-                                    options=[
-                                        {
-                                            "label": "Day of Week",
-                                            "value": "day_of_week",
-                                        },
-                                        {
-                                            "label": "Time of Day",
-                                            "value": "time_of_day",
-                                        },
-                                    ],
-                                    value="time_of_day",
-                                    clearable=False,
-                                ),
-                                dcc.Dropdown(
-                                    id="histogram-value",
-                                    options=[
-                                        {"label": "Messages", "value": "messages"},
-                                        {"label": "Words", "value": "words"},
-                                        {"label": "Characters", "value": "characters"},
-                                    ],
-                                    value="messages",
-                                    clearable=False,
-                                ),
-                            ]
-                        ),
-                        dcc.Loading(dcc.Graph(id="histogram-figure")),
-                    ],
-                    className="histogram",
-                ),
-                # Emoji
-                html.Div(
-                    [
-                        html.H2("Emoji Use"),
-                        dcc.Loading(dcc.Graph(id="emoji-figure")),
-                        dcc.Slider(
-                            id="emoji-threshold",
-                            min=0,
-                            max=100,
-                            step=5,
-                            value=10,
-                            dots=True,
-                            marks={v: f"{v}" for v in range(0, 100 + 1, 10)},
-                        ),
-                    ],
-                    className="emoji",
-                ),
-                # n-grams
-                html.Div(
-                    [
-                        html.H2("N-grams"),
-                        dcc.Slider(
-                            id="ngrams-words",
-                            min=1,
-                            max=10,
-                            step=1,
-                            value=2,
-                            dots=True,
-                            marks={v: f"{v}" for v in range(1, 11, 1)},
-                        ),
-                        dcc.Loading(dcc.Graph(id="ngrams-figure")),
-                        dcc.Slider(
-                            id="ngrams-threshold",
-                            min=0,
-                            max=100,
-                            step=5,
-                            value=10,
-                            dots=True,
-                            marks={v: f"{v}" for v in range(0, 100 + 1, 10)},
-                        ),
-                    ],
-                    className="ngrams",
-                ),
-                # Conversation starter
-                html.Div(
-                    [
-                        html.H2("Conversation starter"),
-                        dcc.Loading(dcc.Graph(id="conversation-starter-figure")),
-                        dcc.Slider(
-                            id="conversation-starter-threshold",
-                            min=0,
-                            max=6,
-                            step=0.5,
-                            value=2,
-                            dots=True,
-                            marks={v: f"{v}h" for v in range(0, 6 + 1, 1)},
-                        ),
-                    ],
-                    className="conversation-starter",
-                ),
-            ],
-            className="content",
-        ),
-    ]
+MESSAGES = store.MessageIndex(
+    store.compact_messages(
+        db.fetch_messages(CONFIG, as_dataframe=True, with_json=False), CONVS
+    )
+)
+LOGGER.info(f"Memory used by the messages:\n{store.memory_report(MESSAGES.messages)}")
+REPLIES = store.MessageIndex(latency.reply_latencies(MESSAGES.messages))
+ATTACHMENTS = store.MessageIndex(
+    store.compact_attachments(db.fetch_attachments(CONFIG), CONVS)
 )
 
+# Maximum number of members shown individually in the group member panel.
+MAX_MEMBERS = 20
 
-def load_messages():
-    """Load the messages, possibly updating the global variable if needed."""
-    global LAST_UPDATE
-    global MESSAGES
-
-    if MESSAGES is None or time.time() - LAST_UPDATE > 60:
-        LOGGER.info("Updating messages...")
-        LAST_UPDATE = time.time()
-        MESSAGES = db.fetch_messages(CONFIG, as_dataframe=True)
-    else:
-        LOGGER.debug("Using pre-fetched messages.")
-
-    return MESSAGES.copy()
+JOBS = jobs.JobQueue(CONFIG["workers"])
+# How long (in seconds) a callback waits for its job before rendering the
+# partial result.
+JOB_WAIT = 0.5
+# Number of emoji or n-grams of each direction in the partial counts.
+PARTIAL_TOP = 100
 
+APP = dash.Dash("signal-statistics")
+# APP.config["suppress_callback_exceptions"] = True
 
-def select_conversation(messages, conversation):
-    """Select those messages which belong to the selected conversation."""
-    if conversation:
-        messages = messages[messages["conversation_id"] == conversation.encode("UTF-8")]
 
-    return messages
+def layout():
+    """Create the layout of the dashboard, with a new session ID for each
+    client."""
+    return html.Div(
+        [
+            # Header
+            html.Div(
+                [
+                    html.Span("Signal Conversation Statistics", className="title"),
+                    html.Div(
+                        [
+                            dcc.Dropdown(
+                                id="conversation",
+                                options=sorted(
+                                    [
+                                        {"label": v, "value": k.decode("UTF-8")}
+                                        for k, v in CONVS.items()
+                                    ],
+                                    key=lambda o: o["label"],
+                                ),
+                            )
+                        ],
+                        className="conversation-selector",
+                    ),
+                ],
+                className="header",
+            ),
+            # Identifies the client, whose background jobs are kept apart
+            dcc.Store(id="session", data=str(uuid.uuid4())),
+            # Data version, bumped whenever new messages are loaded
+            dcc.Store(id="data-version", data=DATA_VERSION),
+            dcc.Interval(id="data-version-interval", interval=1000),
+            # Content
+            html.Div(
+                [
+                    # Timeline
+                    html.Div(
+                        [
+                            html.H2("Conversation Timeline"),
+                            dcc.Tabs(
+                                [
+                                    dcc.Tab(label="Messages", value="messages"),
+                                    dcc.Tab(label="Words", value="words"),
+                                    dcc.Tab(label="Characters", value="characters"),
+                                ],
+                                id="timeline-value",
+                                value="messages",
+                            ),
+                            dcc.Loading(dcc.Graph(id="timeline-figure")),
+                        ],
+                        className="timeline",
+                    ),
+                    # Histogram
+                    html.Div(
+                        [
+                            html.H2("Histogram"),
+                            html.Div(
+                                [
+                                    dcc.Dropdown(
+                                        id="histogram-reduction",
+                                        options=[
+                                            {
+                                                "label": "Day of Week",
+                                                "value": "day_of_week",
+                                            },
+                                            {
+                                                "label": "Time of Day",
+                                                "value": "time_of_day",
+                                            },
+                                        ],
+                                        value="time_of_day",
+                                        clearable=False,
+                                    ),
+                                    dcc.Dropdown(
+                                        id="histogram-value",
+                                        options=[
+                                            {"label": "Messages", "value": "messages"},
+                                            {"label": "Words", "value": "words"},
+                                            {
+                                                "label": "Characters",
+                                                "value": "characters",
+                                            },
+                                        ],
+                                        value="messages",
+                                        clearable=False,
+                                    ),
+                                ]
+                            ),
+                            dcc.Loading(dcc.Graph(id="histogram-figure")),
+                        ],
+                        className="histogram",
+                    ),
+                    # Emoji
+                    html.Div(
+                        [
+                            html.H2("Emoji Use"),
+                            dcc.RadioItems(
+                                id="emoji-mode",
+                                options=[
+                                    {"label": "Exact", "value": "exact"},
+                                    {"label": "Approximate", "value": "approximate"},
+                                ],
+                                value="exact",
+                            ),
+                            dcc.Loading(dcc.Graph(id="emoji-figure")),
+                            # Polls the progress of the background job
+                            dcc.Interval(id="emoji-interval", interval=500),
+                            dcc.Store(id="emoji-rendered"),
+                            dcc.Slider(
+                                id="emoji-threshold",
+                                min=0,
+                                max=100,
+                                step=5,
+                                value=10,
+                                dots=True,
+                                marks={v: f"{v}" for v in range(0, 100 + 1, 10)},
+                            ),
+                        ],
+                        className="emoji",
+                    ),
+                    # n-grams
+                    html.Div(
+                        [
+                            html.H2("N-grams"),
+                            dcc.RadioItems(
+                                id="ngrams-mode",
+                                options=[
+                                    {"label": "Exact", "value": "exact"},
+                                    {"label": "Approximate", "value": "approximate"},
+                                ],
+                                value="exact",
+                            ),
+                            dcc.Slider(
+                                id="ngrams-words",
+                                min=1,
+                                max=10,
+                                step=1,
+                                value=2,
+                                dots=True,
+                                marks={v: f"{v}" for v in range(1, 11, 1)},
+                            ),
+                            dcc.Loading(dcc.Graph(id="ngrams-figure")),
+                            # Polls the progress of the background job
+                            dcc.Interval(id="ngrams-interval", interval=500),
+                            dcc.Store(id="ngrams-rendered"),
+                            dcc.Slider(
+                                id="ngrams-threshold",
+                                min=0,
+                                max=100,
+                                step=5,
+                                value=10,
+                                dots=True,
+                                marks={v: f"{v}" for v in range(0, 100 + 1, 10)},
+                            ),
+                        ],
+                        className="ngrams",
+                    ),
+                    # Conversation starter
+                    html.Div(
+                        [
+                            html.H2("Conversation starter"),
+                            dcc.Loading(dcc.Graph(id="conversation-starter-figure")),
+                            dcc.Slider(
+                                id="conversation-starter-threshold",
+                                min=0,
+                                max=6,
+                                step=0.5,
+                                value=2,
+                                dots=True,
+                                marks={v: f"{v}h" for v in range(0, 6 + 1, 1)},
+                            ),
+                        ],
+                        className="conversation-starter",
+                    ),
+                    # Reply latency
+                    html.Div(
+                        [
+                            html.H2("Reply latency"),
+                            dcc.Loading(dcc.Graph(id="latency-percentiles-figure")),
+                            dcc.Tabs(
+                                [
+                                    dcc.Tab(label="Received", value="incoming"),
+                                    dcc.Tab(label="Sent", value="outgoing"),
+                                ],
+                                id="latency-direction",
+                                value="incoming",
+                            ),
+                            dcc.Loading(dcc.Graph(id="latency-heatmap-figure")),
+                        ],
+                        className="latency",
+                    ),
+                    # Group members
+                    html.Div(
+                        [
+                            html.H2("Group members"),
+                            dcc.Tabs(
+                                [
+                                    dcc.Tab(label="Totals", value="totals"),
+                                    dcc.Tab(label="Time of Day", value="time_of_day"),
+                                    dcc.Tab(label="Day of Week", value="day_of_week"),
+                                    dcc.Tab(label="Emoji", value="emoji"),
+                                    dcc.Tab(label="N-grams", value="ngrams"),
+                                ],
+                                id="members-view",
+                                value="totals",
+                            ),
+                            dcc.Dropdown(
+                                id="members-value",
+                                options=[
+                                    {"label": "Messages", "value": "messages"},
+                                    {"label": "Words", "value": "words"},
+                                    {"label": "Characters", "value": "characters"},
+                                ],
+                                value="messages",
+                                clearable=False,
+                            ),
+                            dcc.Loading(dcc.Graph(id="members-figure")),
+                            # Polls the progress of the background job
+                            dcc.Interval(id="members-interval", interval=500),
+                            dcc.Store(id="members-rendered"),
+                        ],
+                        className="members",
+                    ),
+                    # Media
+                    html.Div(
+                        [
+                            html.H2("Media"),
+                            dcc.Tabs(
+                                [
+                                    dcc.Tab(label="Size", value="size"),
+                                    dcc.Tab(label="Files", value="files"),
+                                ],
+                                id="media-value",
+                                value="size",
+                            ),
+                            dcc.Loading(dcc.Graph(id="media-figure")),
+                        ],
+                        className="media",
+                    ),
+                ],
+                className="content",
+            ),
+        ]
+    )
 
 
-def split_messages(messages, conversation):
-    """Select those messages which belong to the selected conversation and split
-    them into incoming and outgoing messages."""
-    messages = select_conversation(messages, conversation)
+APP.layout = layout
 
-    return (messages.query("type == 'incoming'"), messages.query("type == 'outgoing'"))
 
+def refresh_messages():
+    """Fetch the messages received since the last update and refresh the data
+    derived from them.
 
-def filter_timeline(messages, timeline_data):
-    """Filter messages selecting only those messages in the timeline's range."""
+    This is called by the database watcher whenever Signal's database
+    changes.
+    """
+    global DATA_VERSION
+    global MESSAGES
+    global REPLIES
+    global ATTACHMENTS
+
+    with DATA_LOCK:
+        messages = MESSAGES.messages
+
+        # Overlap with the previous fetch slightly to be robust against
+        # clock adjustments; messages already loaded are ignored below.
+        since = None
+        if not messages.empty:
+            since = messages["received_at"].max() - timedelta(hours=1)
+        new = db.fetch_messages(CONFIG, as_dataframe=True, since=since, with_json=False)
+        new = new[~new["id"].isin(messages["id"])]
+        if new.empty:
+            LOGGER.debug("No new messages.")
+            return
+
+        LOGGER.info(f"Loaded {len(new.index)} new messages.")
+        messages = store.append_messages(messages, new)
+
+        attachments = db.fetch_attachments(CONFIG, since=since)
+        attachments = attachments[
+            ~attachments["message_id"].isin(ATTACHMENTS.messages["message_id"])
+        ]
+        attachments = store.append_attachments(ATTACHMENTS.messages, attachments)
+
+        MESSAGES = store.MessageIndex(messages)
+        REPLIES = store.MessageIndex(latency.reply_latencies(messages))
+        ATTACHMENTS = store.MessageIndex(attachments)
+        DATA_VERSION += 1
+        member_activity.cache_clear()
+
+
+def timeline_range(timeline_data):
+    """Obtain the range selected in the timeline, or `(None, None)` if the
+    whole timeline is shown."""
     if timeline_data is None:
-        return messages
+        return None, None
 
     if "xaxis.range" in timeline_data:
         start, end = timeline_data["xaxis.range"]
@@ -221,28 +358,49 @@ def filter_timeline(messages, timeline_data):
         start = timeline_data["xaxis.range[0]"]
         end = timeline_data["xaxis.range[1]"]
     else:
-        return messages
+        return None, None
 
-    start = pd.to_datetime(start)
-    end = pd.to_datetime(end)
-    messages = messages[(start < messages["sent_at"]) & (messages["sent_at"] < end)]
-    return messages
+    return pd.to_datetime(start), pd.to_datetime(end)
+
+
+def select_messages(index, conversation, timeline_data=None, direction=None):
+    """Select those messages from the index which belong to the selected
+    conversation and are in the timeline's range, optionally only those in
+    the given direction."""
+    start, end = timeline_range(timeline_data)
+    if conversation:
+        conversation = conversation.encode("UTF-8")
+    else:
+        conversation = None
+
+    return index.select(conversation, direction, start, end)
+
+
+def split_messages(conversation, timeline_data=None):
+    """Select those messages which belong to the selected conversation and are
+    in the timeline's range, and split them into incoming and outgoing
+    messages."""
+    return (
+        select_messages(MESSAGES, conversation, timeline_data, "incoming"),
+        select_messages(MESSAGES, conversation, timeline_data, "outgoing"),
+    )
 
 
 @APP.callback(
     Output("timeline-figure", "figure"),
-    [Input("timeline-value", "value"), Input("conversation", "value")],
+    [
+        Input("timeline-value", "value"),
+        Input("conversation", "value"),
+        Input("data-version", "data"),
+    ],
 )
-def timeline(value, conversation):
+def timeline(value, conversation, _data_version):
     """Create a timeline of the timeline showing how much activity there was on
     each day."""
 
-    messages = load_messages()
-    messages["messages"] = messages["body"].apply(lambda x: 1 if x else 0)
-    messages["words"] = messages["body"].apply(lambda x: len(x.split()) if x else 0)
-    messages["characters"] = messages["body"].apply(lambda x: len(x) if x else 0)
-
-    incoming, outgoing = split_messages(messages, conversation)
+    incoming, outgoing = split_messages(conversation)
+    incoming = analytics.add_metrics(incoming)
+    outgoing = analytics.add_metrics(outgoing)
 
     hist_options = {"xbins": {"size": "1D"}, "histfunc": "sum", "opacity": 0.5}
     layout = {
@@ -293,46 +451,30 @@ def timeline(value, conversation):
         Input("histogram-reduction", "value"),
         Input("conversation", "value"),
         Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
     ],
 )
-def histogram(value, reduction, conversation, timeline_data):
+def histogram(value, reduction, conversation, timeline_data, _data_version):
     """Create a histogram of the conversation, reducing the data as per the
     reduction."""
 
-    messages = load_messages()
-    messages = filter_timeline(messages, timeline_data)
-
-    messages["messages"] = messages["body"].apply(lambda x: 1 if x else 0)
-    messages["words"] = messages["body"].apply(lambda x: len(x.split()) if x else 0)
-    messages["characters"] = messages["body"].apply(lambda x: len(x) if x else 0)
-    messages["time_of_day"] = messages["sent_at"].apply(
-        lambda t: t.hour + t.minute / 60 + t.second / 60 / 60
-    )
-    messages["day_of_week"] = messages["sent_at"].apply(lambda t: t.weekday())
-    messages.sort_values(by=reduction, inplace=True)
-
-    incoming, outgoing = split_messages(messages, conversation)
+    incoming, outgoing = split_messages(conversation, timeline_data)
+    for messages in (incoming, outgoing):
+        analytics.add_metrics(messages)
+        analytics.add_reductions(messages)
+        messages.sort_values(by=reduction, inplace=True)
 
     hist_options = {"opacity": 0.5}
     layout = {"bargap": 0.2, "bargroupgap": 0.0}
 
     if reduction == "day_of_week":
-        print(messages[value].unique())
         hist_options["nbinsx"] = 7
         # hist_options["xbins"] = {"size": 1}
         layout["xaxis"] = {
             "type": "category",
             "tickmode": "array",
             "tickvals": [0, 1, 2, 3, 4, 5, 6],
-            "ticktext": [
-                "Monday",
-                "Tuesday",
-                "Wednesday",
-                "Thursday",
-                "Friday",
-                "Saturday",
-                "Sunday",
-            ],
+            "ticktext": analytics.DAYS_OF_WEEK,
         }
     elif reduction == "time_of_day":
         hist_options["nbinsx"] = 24
@@ -354,177 +496,500 @@ def histogram(value, reduction, conversation, timeline_data):
     return dict(data=data, layout=layout)
 
 
+def count_figure(data, bound, mode):
+    """Create a bar chart of the counts obtained from
+    `analytics.count_items`."""
+    hist_options = {"opacity": 0.5}
+    layout = {"bargap": 0.2, "bargroupgap": 0.0}
+
+    errors = {"incoming": None, "outgoing": None}
+    if mode == "approximate":
+        layout["title"] = (
+            f"Approximate counts (at most {CONFIG['sketch_capacity']} items "
+            f"tracked, error at most {bound})"
+        )
+        for direction in errors:
+            errors[direction] = {
+                "type": "data",
+                "symmetric": False,
+                "array": data[f"{direction}_plus"],
+                "arrayminus": data[f"{direction}_minus"],
+            }
+
+    return [
+        go.Bar(
+            x=data.index,
+            y=data["incoming"],
+            error_y=errors["incoming"],
+            name="Received",
+            **hist_options,
+        ),
+        go.Bar(
+            x=data.index,
+            y=data["outgoing"],
+            error_y=errors["outgoing"],
+            name="Sent",
+            **hist_options,
+        ),
+    ], layout
+
+
+def count_job(job, conversation, timeline_data, extract, mode):
+    """Count the emoji or n-grams of the conversation in the background,
+    reporting the partial counts whenever they are requested."""
+    incoming, outgoing = split_messages(conversation, timeline_data)
+    reverse = incoming.size < outgoing.size
+
+    for progress, counters in analytics.iter_count_items(
+        incoming, outgoing, extract, mode, CONFIG["sketch_capacity"]
+    ):
+        partial = None
+        if job.partial_requested:
+            data, bound = analytics.count_frame(counters, mode, top=PARTIAL_TOP)
+            partial = (data, bound, reverse)
+        job.update(progress, partial)
+
+    return (*analytics.count_frame(counters, mode), reverse)
+
+
+def render_job(job, render, interval, rendered):
+    """Render the result of a job into a figure.
+
+    Until the job is finished, its partial result (if any) is rendered along
+    with its progress.  `rendered` is the state of the job when the client
+    last rendered it, so that the figure is only updated by the job
+    `interval` if the job has progressed since.
+
+    Returns the figure, the state of the job as rendered and whether the
+    interval should be disabled, as the job is no longer running.
+    """
+    job.wait(JOB_WAIT)
+    if job.cancelled:
+        raise PreventUpdate
+    state = [job.done, job.progress]
+
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+    if triggered == [f"{interval}.n_intervals"] and rendered == state:
+        raise PreventUpdate
+
+    if job.error is not None:
+        figure = dict(data=[], layout={"title": f"Failed: {job.error}"})
+        return figure, state, True
+    if job.done:
+        return render(*job.result), state, True
+
+    job.request_partial()
+    if job.partial is None:
+        figure = dict(data=[], layout={})
+    else:
+        figure = render(*job.partial)
+    title = figure["layout"].get("title")
+    progress = f"Computing... {job.progress:.0%}"
+    figure["layout"]["title"] = f"{progress} {title}" if title else progress
+
+    return figure, state, False
+
+
+def render_counts(threshold, mode):
+    """Create a function rendering the result of `count_job` into a
+    figure."""
+
+    def render(data, bound, reverse):
+        data = data.query(f"total >= {threshold}")
+        data, layout = count_figure(data, bound, mode)
+        if reverse:
+            data.reverse()
+        return dict(data=data, layout=layout)
+
+    return render
+
+
 @APP.callback(
-    Output("emoji-figure", "figure"),
+    [
+        Output("emoji-figure", "figure"),
+        Output("emoji-rendered", "data"),
+        Output("emoji-interval", "disabled"),
+    ],
     [
         Input("emoji-threshold", "value"),
+        Input("emoji-mode", "value"),
         Input("conversation", "value"),
         Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
+        Input("emoji-interval", "n_intervals"),
     ],
+    [State("session", "data"), State("emoji-rendered", "data")],
 )
-def emoji_use(threshold, conversation, timeline_data):
+def emoji_use(
+    threshold, mode, conversation, timeline_data, _data_version, _n, session, rendered
+):
     """Create a histogram of the conversation, reducing the data as per the
     reduction."""
+    key = (conversation, timeline_range(timeline_data), mode, DATA_VERSION)
+    job = JOBS.submit(
+        "emoji",
+        session,
+        key,
+        count_job,
+        conversation,
+        timeline_data,
+        analytics.message_emoji,
+        mode,
+    )
+
+    return render_job(job, render_counts(threshold, mode), "emoji-interval", rendered)
 
-    messages = load_messages()
-    messages = filter_timeline(messages, timeline_data)
 
-    messages["emoji"] = (
-        messages["body"]
-        .apply(lambda txt: txt if txt else "")
-        .apply(lambda txt: [l for l in txt if l in EMOJI_SET])
+@APP.callback(
+    [
+        Output("ngrams-figure", "figure"),
+        Output("ngrams-rendered", "data"),
+        Output("ngrams-interval", "disabled"),
+    ],
+    [
+        Input("ngrams-words", "value"),
+        Input("ngrams-threshold", "value"),
+        Input("ngrams-mode", "value"),
+        Input("conversation", "value"),
+        Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
+        Input("ngrams-interval", "n_intervals"),
+    ],
+    [State("session", "data"), State("ngrams-rendered", "data")],
+)
+def ngrams(
+    n,
+    threshold,
+    mode,
+    conversation,
+    timeline_data,
+    _data_version,
+    _n,
+    session,
+    rendered,
+):
+    """Create a histogram of the conversation, reducing the data as per the
+    reduction."""
+    key = (n, conversation, timeline_range(timeline_data), mode, DATA_VERSION)
+    job = JOBS.submit(
+        "ngrams",
+        session,
+        key,
+        count_job,
+        conversation,
+        timeline_data,
+        functools.partial(analytics.message_ngrams, n=n),
+        mode,
     )
 
-    incoming, outgoing = split_messages(messages, conversation)
-    values, counts = np.unique(incoming["emoji"].sum(), return_counts=True)
-    in_emojis = pd.Series(index=values, data=counts)
-    values, counts = np.unique(outgoing["emoji"].sum(), return_counts=True)
-    out_emojis = pd.Series(index=values, data=counts)
+    return render_job(job, render_counts(threshold, mode), "ngrams-interval", rendered)
 
-    data = pd.concat(
-        {"incoming": in_emojis, "outgoing": out_emojis}, axis=1, sort=False
-    ).fillna(0)
-    data["total"] = data["incoming"] + data["outgoing"]
-    data.sort_values(by="total", inplace=True, ascending=False)
-    data = data.query(f"total >= {threshold}")
+
+@APP.callback(
+    Output("conversation-starter-figure", "figure"),
+    [
+        Input("conversation-starter-threshold", "value"),
+        Input("conversation", "value"),
+        Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
+    ],
+)
+def conversation_starter(threshold, conversation, timeline_data, _data_version):
+    """Create a pie chart of who initiates conversations"""
+    if conversation:
+        conversation_label = CONVS[conversation.encode("UTF-8")]
+    else:
+        conversation_label = "Others"
+
+    messages = select_messages(MESSAGES, conversation, timeline_data)
+
+    data = analytics.conversation_starters(messages, threshold)
+    data.index = data.index.map({"outgoing": "Me", "incoming": conversation_label})
+
+    layout = {}
+
+    data = [go.Pie(labels=data.index, values=data.values)]
+
+    return dict(data=data, layout=layout)
+
+
+@APP.callback(
+    Output("latency-percentiles-figure", "figure"),
+    [
+        Input("conversation", "value"),
+        Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
+    ],
+)
+def latency_percentiles(conversation, timeline_data, _data_version):
+    """Create a bar chart of the percentiles of the reply latency."""
+    replies = select_messages(REPLIES, conversation, timeline_data)
+
+    data = latency.percentiles(replies) / 60
 
     hist_options = {"opacity": 0.5}
-    layout = {"bargap": 0.2, "bargroupgap": 0.0}
+    layout = {
+        "bargap": 0.2,
+        "bargroupgap": 0.0,
+        "xaxis": {"type": "category", "title": "Percentile"},
+        "yaxis": {"type": "log", "title": "Minutes"},
+    }
 
+    labels = [f"{q}%" for q in data.index]
     data = [
-        go.Bar(x=data.index, y=data["incoming"], name="Received", **hist_options),
-        go.Bar(x=data.index, y=data["outgoing"], name="Sent", **hist_options),
+        go.Bar(x=labels, y=data["incoming"], name="Received", **hist_options),
+        go.Bar(x=labels, y=data["outgoing"], name="Sent", **hist_options),
     ]
 
-    if incoming.size < outgoing.size:
-        data.reverse()
+    return dict(data=data, layout=layout)
+
+
+@APP.callback(
+    Output("latency-heatmap-figure", "figure"),
+    [
+        Input("latency-direction", "value"),
+        Input("conversation", "value"),
+        Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
+    ],
+)
+def latency_heatmap(direction, conversation, timeline_data, _data_version):
+    """Create a heatmap of the median reply latency for each hour of the
+    week."""
+    replies = select_messages(REPLIES, conversation, timeline_data)
+
+    data = latency.hourly_heatmap(replies, direction) / 60
+
+    layout = {
+        "xaxis": {"title": "Time of Day", "tick0": 0, "dtick": 1},
+        "yaxis": {"autorange": "reversed"},
+    }
+
+    data = [
+        go.Heatmap(
+            z=data.values,
+            x=list(data.columns),
+            y=analytics.DAYS_OF_WEEK,
+            colorbar={"title": "Minutes"},
+        )
+    ]
 
     return dict(data=data, layout=layout)
 
 
 @APP.callback(
-    Output("ngrams-figure", "figure"),
+    Output("media-figure", "figure"),
     [
-        Input("ngrams-words", "value"),
-        Input("ngrams-threshold", "value"),
+        Input("media-value", "value"),
         Input("conversation", "value"),
         Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
     ],
 )
-def ngrams(n, threshold, conversation, timeline_data):
-    """Create a histogram of the conversation, reducing the data as per the
-    reduction."""
+def media(value, conversation, timeline_data, _data_version):
+    """Create a histogram of the size or number of the attachments exchanged
+    each month."""
+    hist_options = {"histfunc": "sum", "xbins": {"size": "M1"}, "opacity": 0.5}
+    layout = {
+        "barmode": "group",
+        "bargap": 0.2,
+        "bargroupgap": 0.0,
+        "yaxis": {"title": "Megabytes" if value == "size" else "Files"},
+    }
 
-    messages = load_messages()
-    messages = filter_timeline(messages, timeline_data)
-
-    punct = re.compile("[.,;:!?]")
-
-    messages["ngrams"] = (
-        messages["body"]
-        # Lowercase everything
-        .apply(lambda x: x.lower() if x else "")
-        # Replace ’ with '
-        .apply(lambda x: x.replace("’", "'"))
-        # split at punctuation (ngrams don't cross a full stop)
-        .apply(punct.split)
-        # split each segment now based on whitespace
-        .apply(lambda x: [s.split() for s in x])
-        # take all n-contiguous subsets of each split segment, and join them
-        # with a whitespace
-        .apply(
-            lambda x: [
-                [" ".join(s[i : i + n]) for i in range(len(s) - n + 1)] for s in x
-            ]
+    data = []
+    for direction, name in [("incoming", "Received"), ("outgoing", "Sent")]:
+        attachments = select_messages(
+            ATTACHMENTS, conversation, timeline_data, direction
+        )
+        if value == "size":
+            y = attachments["size"] / 1e6
+        else:
+            y = pd.Series(1, index=attachments.index)
+        data.append(
+            go.Histogram(x=attachments["sent_at"], y=y, name=name, **hist_options)
         )
-        # flatten the array
-        .apply(lambda x: list(itertools.chain(*x)))
-    )
 
-    incoming, outgoing = split_messages(messages, conversation)
-    values, counts = np.unique(incoming["ngrams"].sum(), return_counts=True)
-    in_grams = pd.Series(index=values, data=counts)
-    values, counts = np.unique(outgoing["ngrams"].sum(), return_counts=True)
-    out_grams = pd.Series(index=values, data=counts)
+    return dict(data=data, layout=layout)
 
-    data = pd.concat(
-        {"incoming": in_grams, "outgoing": out_grams}, axis=1, sort=False
-    ).fillna(0)
-    data["total"] = data["incoming"] + data["outgoing"]
-    data.sort_values(by="total", inplace=True, ascending=False)
-    data = data.query(f"total >= {threshold}")
 
-    hist_options = {"opacity": 0.5}
-    layout = {"bargap": 0.2, "bargroupgap": 0.0}
+def member_name(member):
+    """Obtain the display name of a group member."""
+    return CONVS.get(member.encode("UTF-8"), member)
 
-    data = [
-        go.Bar(x=data.index, y=data["incoming"], name="Received", **hist_options),
-        go.Bar(x=data.index, y=data["outgoing"], name="Sent", **hist_options),
-    ]
 
-    if incoming.size < outgoing.size:
-        data.reverse()
+@functools.lru_cache(maxsize=32)
+def member_activity(conversation, start, end, _data_version):
+    """Compute (and cache) the activity of each member of a conversation
+    within the given range."""
+    messages = MESSAGES.select(conversation, None, start, end)
+    messages = analytics.add_metrics(messages)
+    messages = analytics.add_members(messages)
+
+    return analytics.member_activity(messages)
+
+
+def member_items_job(job, conversation, start, end, extract):
+    """Count the emoji or n-grams of each member of a conversation within the
+    given range in the background."""
+    messages = MESSAGES.select(conversation, None, start, end)
+    messages = analytics.add_members(messages)
+
+    for progress, counts in analytics.iter_member_items(messages, extract):
+        job.update(progress)
+
+    return (analytics.member_counts(counts),)
+
+
+def member_activity_figure(activity, totals, view, value, shown, layout):
+    """Create a bar chart of the totals or a heatmap of the histograms of the
+    members' activity."""
+    if view == "totals":
+        names = [member_name(m) for m in shown]
+        data = [go.Bar(x=names, y=totals.loc[shown, value])]
+        return dict(data=data, layout=layout)
+
+    level = "hour" if view == "time_of_day" else "day_of_week"
+    columns = range(24) if view == "time_of_day" else range(7)
+    hist = activity[value].groupby(level=["member", level]).sum().unstack()
+    hist = hist.reindex(index=shown, columns=columns).fillna(0)
+
+    if view == "time_of_day":
+        layout["xaxis"] = {"title": "Time of Day", "tick0": 0, "dtick": 1}
+        x = list(columns)
+    else:
+        x = analytics.DAYS_OF_WEEK
+    names = [member_name(m) for m in hist.index]
+    data = [go.Heatmap(z=hist.values, x=x, y=names)]
 
     return dict(data=data, layout=layout)
 
 
+def render_member_items(shown, layout):
+    """Create a function rendering the result of `member_items_job` into a
+    stacked bar chart of the most common items."""
+
+    def render(counts):
+        if counts.empty:
+            return dict(data=[], layout=dict(layout))
+        counts = counts.unstack(level="member", fill_value=0)
+        top = counts.sum(axis=1).sort_values(ascending=False).index[:MAX_MEMBERS]
+        counts = counts.loc[top]
+
+        others = [m for m in counts.columns if m not in shown]
+        if others:
+            counts["Others"] = counts[others].sum(axis=1)
+        data = [
+            go.Bar(x=counts.index, y=counts[m], name=member_name(m))
+            for m in [m for m in shown if m in counts.columns]
+        ]
+        if others:
+            data.append(go.Bar(x=counts.index, y=counts["Others"], name="Others"))
+
+        return dict(data=data, layout=dict(layout, barmode="stack"))
+
+    return render
+
+
 @APP.callback(
-    Output("conversation-starter-figure", "figure"),
     [
-        Input("conversation-starter-threshold", "value"),
+        Output("members-figure", "figure"),
+        Output("members-rendered", "data"),
+        Output("members-interval", "disabled"),
+    ],
+    [
+        Input("members-view", "value"),
+        Input("members-value", "value"),
+        Input("ngrams-words", "value"),
         Input("conversation", "value"),
         Input("timeline-figure", "relayoutData"),
+        Input("data-version", "data"),
+        Input("members-interval", "n_intervals"),
     ],
+    [State("session", "data"), State("members-rendered", "data")],
 )
-def conversation_starter(threshold, conversation, timeline_data):
-    """Create a pie chart of who initiates conversations"""
-    if conversation:
-        conversation_label = CONVS[conversation.encode("UTF-8")]
-    else:
-        conversation_label = "Others"
+def members(
+    view,
+    value,
+    n,
+    conversation,
+    timeline_data,
+    _data_version,
+    _n,
+    session,
+    rendered,
+):
+    """Create a breakdown of the conversation by the member who sent each
+    message.
+
+    The emoji and n-grams of each member are counted in the background, while
+    the activity of the members is cheap enough to be computed directly.
+    """
+    start, end = timeline_range(timeline_data)
+    conversation = conversation.encode("UTF-8") if conversation else None
 
-    messages = load_messages()
-    messages = filter_timeline(messages, timeline_data)
-    messages = select_conversation(messages, conversation)
+    layout = {"bargap": 0.2, "bargroupgap": 0.0}
 
-    threshold = timedelta(seconds=threshold * 3600)
-    conversations = [
-        {
-            "starter": messages.iloc[0]["type"],
-            "start": messages.iloc[0]["sent_at"],
-            "last": messages.iloc[0]["sent_at"],
-        }
-    ]
-    for _, msg in messages.iterrows():
-        if msg["sent_at"] - conversations[-1]["last"] < threshold:
-            conversations[-1]["last"] = msg["sent_at"]
-        else:
-            conversations.append(
-                {
-                    "starter": msg["type"],
-                    "start": msg["sent_at"],
-                    "last": msg["sent_at"],
-                }
-            )
-    conversations = pd.DataFrame(conversations)
-    conversations["length"] = conversations["last"] - conversations["start"]
-
-    data = conversations["starter"].value_counts().to_frame()
-    data.index = data.index.map({"outgoing": "Me", "incoming": conversation_label})
-    data["msg_count"] = 0
-    for idx in data.index:
-        data.loc[idx, "msg_count"] = len(messages.query(f"type == '{idx}'").index)
-    data.sort_values(by="msg_count", inplace=True)
+    activity = member_activity(conversation, start, end, DATA_VERSION)
+    if activity.empty:
+        JOBS.cancel("members", session)
+        return dict(data=[], layout=layout), None, True
 
-    layout = {}
+    totals = activity.groupby(level="member").sum()
+    totals = totals.sort_values(by=value, ascending=False)
+    shown = totals.index[:MAX_MEMBERS]
 
-    data = [go.Pie(labels=data.index, values=data["starter"])]
+    if view not in ["emoji", "ngrams"]:
+        JOBS.cancel("members", session)
+        figure = member_activity_figure(activity, totals, view, value, shown, layout)
+        return figure, None, True
 
-    return dict(data=data, layout=layout)
+    if view == "emoji":
+        extract = analytics.message_emoji
+    else:
+        extract = functools.partial(analytics.message_ngrams, n=n)
+    key = (
+        view,
+        n if view == "ngrams" else None,
+        conversation,
+        start,
+        end,
+        DATA_VERSION,
+    )
+    job = JOBS.submit(
+        "members",
+        session,
+        key,
+        member_items_job,
+        conversation,
+        start,
+        end,
+        extract,
+    )
+
+    return render_job(
+        job, render_member_items(shown, layout), "members-interval", rendered
+    )
+
+
+@APP.callback(
+    Output("data-version", "data"),
+    [Input("data-version-interval", "n_intervals")],
+    [State("data-version", "data")],
+)
+def data_version(_n_intervals, current):
+    """Push the data version to the dashboard whenever new messages are
+    loaded, which in turn updates all the figures."""
+    if current == DATA_VERSION:
+        raise PreventUpdate
+    return DATA_VERSION
 
 
 def main(debug):
     """Start the plot.ly server"""
+    LOGGER.info("Watching the database for changes")
+    watch.DatabaseWatcher(CONFIG, refresh_messages).start()
+
     LOGGER.info("Starting plot.ly server")
 
     APP.run_server(debug=debug)
@@ -0,0 +1,223 @@
+"""Compact in-memory representation of the messages"""
+
+import importlib.util
+import logging
+
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _string_dtype():
+    """Select the most compact string dtype supported by the installed
+    versions of pandas and pyarrow."""
+    if not hasattr(pd, "StringDtype"):
+        # pandas < 1.0 has no dedicated string dtype.
+        return object
+    if importlib.util.find_spec("pyarrow") is not None:
+        try:
+            return pd.StringDtype("pyarrow")
+        except (TypeError, ImportError):
+            # pandas < 1.3, or a version of pyarrow which is too old.
+            pass
+    return pd.StringDtype()
+
+
+STRING_DTYPE = _string_dtype()
+
+# Columns stored as (Arrow-backed, if available) strings.
+STRING_COLUMNS = ["id", "type", "body"]
+ATTACHMENT_STRING_COLUMNS = ["message_id", "type", "path", "file_name"]
+
+
+def intern(values, categories=None):
+    """Intern the values into integer codes.
+
+    The lookup table starts with `categories` (if given), so that the codes
+    of those values are unchanged, and is extended with any other values
+    which are encountered.
+    """
+    categories = list(categories) if categories is not None else []
+    known = set(categories)
+    categories += [v for v in pd.unique(values.dropna()) if v not in known]
+
+    return pd.Categorical(values, categories=categories)
+
+
+def _compact(frame, strings, interned):
+    """Convert the `strings` columns of the frame to strings, and intern the
+    columns in `interned` starting from their given lookup tables."""
+    for col in strings:
+        frame[col] = frame[col].astype(STRING_DTYPE)
+    for col, categories in interned.items():
+        frame[col] = intern(frame[col], categories)
+
+    return frame
+
+
+def _append(frame, new, strings):
+    """Append a new frame to a compact frame, extending the lookup tables so
+    that the codes of the existing rows remain valid."""
+    interned = {
+        col: frame[col].cat.categories
+        for col in frame.columns
+        if isinstance(frame[col].dtype, pd.CategoricalDtype)
+    }
+    new = _compact(new, strings, interned)
+
+    frame = frame.copy(deep=False)
+    for col in interned:
+        frame[col] = frame[col].cat.set_categories(new[col].cat.categories)
+
+    return pd.concat([frame, new], ignore_index=True)
+
+
+def compact_messages(messages, conversations=None, senders=None):
+    """Convert messages fetched with `db.fetch_messages` into a compact
+    representation.
+
+    The string columns are converted to `STRING_DTYPE` (Arrow-backed strings
+    when `pyarrow` is installed), while the conversation and sender IDs are
+    interned into integer codes.  The lookup table of conversation IDs starts
+    with the keys of `conversations` (typically from
+    `utilities.conversation_mapping`) and that of the sender IDs with
+    `senders`.  Timestamps are already stored as `datetime64`, which is
+    backed by int64.
+    """
+    return _compact(
+        messages,
+        STRING_COLUMNS,
+        {"conversation_id": conversations, "source": senders},
+    )
+
+
+def append_messages(messages, new):
+    """Append newly fetched messages to compact messages.
+
+    The lookup tables are extended so that the codes of the existing
+    messages remain valid.
+    """
+    return _append(messages, new, STRING_COLUMNS)
+
+
+def compact_attachments(attachments, conversations=None):
+    """Convert the attachment index from `db.fetch_attachments` into a
+    compact representation, in the same way as `compact_messages`.  The
+    content types are interned as well."""
+    return _compact(
+        attachments,
+        ATTACHMENT_STRING_COLUMNS,
+        {"conversation_id": conversations, "content_type": None},
+    )
+
+
+def append_attachments(attachments, new):
+    """Append newly fetched attachments to the compact attachment index."""
+    return _append(attachments, new, ATTACHMENT_STRING_COLUMNS)
+
+
+def memory_report(messages):
+    """Report the type and memory used by each column of the messages."""
+    report = pd.DataFrame(
+        {
+            "dtype": messages.dtypes.astype(str),
+            "bytes": messages.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["total"] = ["", report["bytes"].sum()]
+
+    return report
+
+
+class MessageIndex:
+    """Messages sorted by conversation and time for fast selection.
+
+    The messages (which need `conversation_id`, `type` and `sent_at`
+    columns) are sorted by conversation and then `sent_at`, so that each
+    conversation is a contiguous slice whose offsets are precomputed.  The
+    positions of the messages in each direction are also precomputed, as is
+    the chronological order of all the messages.  A selection therefore only
+    involves slicing and binary searches on the timestamps, and costs time
+    proportional to the size of the result rather than to the number of
+    messages.
+    """
+
+    def __init__(self, messages):
+        messages = messages.sort_values(
+            ["conversation_id", "sent_at"], kind="mergesort"
+        )
+        self.messages = messages.reset_index(drop=True)
+        self._sent_at = self.messages["sent_at"].to_numpy()
+
+        codes, _ = pd.factorize(self.messages["conversation_id"])
+        starts = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        if len(codes):
+            starts = np.r_[0, starts]
+        stops = np.r_[starts[1:], len(codes)].astype(int)
+        keys = self.messages["conversation_id"].to_numpy()
+        self._conversations = {
+            keys[start]: (start, stop)
+            for start, stop in zip(starts, stops)
+            if codes[start] != -1
+        }
+
+        # Positions (in conversation order) of the messages in each direction.
+        direction = self.messages["type"].to_numpy(dtype=object)
+        self._directions = {
+            d: np.flatnonzero(direction == d) for d in pd.unique(direction)
+        }
+
+        # Positions of all the messages in chronological order, and likewise
+        # for each direction, along with their (sorted) timestamps.
+        self._order = np.argsort(self._sent_at, kind="stable")
+        self._order_directions = {
+            d: self._order[direction[self._order] == d] for d in self._directions
+        }
+        self._order_sent_at = self._sent_at[self._order]
+        self._order_directions_sent_at = {
+            d: self._sent_at[positions]
+            for d, positions in self._order_directions.items()
+        }
+
+    def __len__(self):
+        return len(self.messages.index)
+
+    def select(self, conversation=None, direction=None, start=None, end=None):
+        """Select the messages of a conversation (all conversations if
+        `None`), optionally only those in a given direction and sent strictly
+        between `start` and `end`.
+
+        The selected messages are returned in chronological order.
+        """
+        if conversation is None:
+            if direction is None:
+                positions = self._order
+                sent_at = self._order_sent_at
+            else:
+                positions = self._order_directions.get(direction, self._order[:0])
+                sent_at = self._order_directions_sent_at.get(
+                    direction, self._order_sent_at[:0]
+                )
+        else:
+            lo, hi = self._conversations.get(conversation, (0, 0))
+            if direction is None:
+                positions = slice(lo, hi)
+            else:
+                positions = self._directions.get(direction, self._order[:0])
+                lo, hi = positions.searchsorted([lo, hi])
+                positions = positions[lo:hi]
+            # Only the conversation's timestamps are gathered.
+            sent_at = self._sent_at[positions]
+        i, j = 0, len(sent_at)
+        if start is not None:
+            i = sent_at.searchsorted(pd.Timestamp(start).to_datetime64(), side="right")
+        if end is not None:
+            j = sent_at.searchsorted(pd.Timestamp(end).to_datetime64(), side="left")
+
+        if isinstance(positions, slice):
+            positions = slice(positions.start + i, positions.start + max(i, j))
+        else:
+            positions = positions[i:j]
+
+        return self.messages.iloc[positions].copy()
@@ -0,0 +1,212 @@
+"""Synchronise the local analytics database"""
+
+import logging
+import time
+
+import click
+
+import db
+import profiles
+import utilities
+
+LOGGER = logging.getLogger(__name__)
+
+# Messages received up to this long (in milliseconds) before the last
+# synchronised message are fetched again, to be robust against clock
+# adjustments.
+SYNC_OVERLAP = 60 * 60 * 1000
+
+CONVERSATION_COLUMNS = ["id", "type", "name", "profileName", "members"]
+MESSAGE_COLUMNS = [
+    "id",
+    "conversationId",
+    "sent_at",
+    "received_at",
+    "expires_at",
+    "source",
+    "hasAttachments",
+    "type",
+    "body",
+    "json",
+]
+
+
+def sync(config, full=False):
+    """Copy the conversations and the new messages from Signal's database
+    into the local analytics database, and update the daily aggregates of
+    the days which have changed.
+
+    Expiring messages are only copied if `include_expiring` is set, and
+    messages which have expired are removed from the analytics database.  If
+    `full` is True, the analytics database is cleared first so that messages
+    which have since been deleted from Signal are removed too.
+
+    Returns the number of conversations and messages synchronised.
+    """
+    signal_config = dict(config, backend="signal")
+    conn = db.connect_sidecar(config, create=True)
+
+    try:
+        LOGGER.info(f"Synchronising '{config['sidecar_path']}'.")
+        if full:
+            LOGGER.info("Clearing the analytics database.")
+            # Not `executescript`, which would commit the deletions before
+            # the messages have been fetched.
+            for table in ["messages", "attachments", "daily"]:
+                conn.execute(f"DELETE FROM {table}")
+
+        last = conn.execute("SELECT max(received_at) FROM messages").fetchone()[0]
+        cond = []
+        if last is not None:
+            cond.append(f"received_at > {last - SYNC_OVERLAP}")
+        if not config["include_expiring"]:
+            cond.append("expires_at IS NULL")
+
+        conversations = db.fetch(
+            signal_config,
+            f"""
+            SELECT
+                cast(id AS BLOB) id,
+                {', '.join(CONVERSATION_COLUMNS[1:])}
+            FROM conversations""",
+        )
+        messages = db.fetch(
+            signal_config,
+            f"""
+            SELECT
+                id,
+                cast(conversationId AS BLOB) conversationId,
+                {', '.join(MESSAGE_COLUMNS[2:])}
+            FROM messages
+            {'WHERE ' + ' AND '.join(cond) if cond else ''}""",
+        )
+        LOGGER.info(
+            f"Synchronising {len(conversations)} conversations "
+            f"and {len(messages)} messages."
+        )
+
+        conn.executemany(
+            f"""
+            INSERT OR REPLACE INTO conversations ({', '.join(CONVERSATION_COLUMNS)})
+            VALUES ({', '.join('?' * len(CONVERSATION_COLUMNS))})""",
+            (tuple(row) for row in conversations),
+        )
+        conn.executemany(
+            f"""
+            INSERT OR REPLACE INTO messages ({', '.join(MESSAGE_COLUMNS)})
+            VALUES ({', '.join('?' * len(MESSAGE_COLUMNS))})""",
+            (tuple(row) for row in messages),
+        )
+
+        update_attachments(conn, messages, config.get("workers"))
+        expired = remove_expired(conn, config["include_expiring"])
+
+        sent_at = [row["sent_at"] for row in messages] + expired
+        if sent_at:
+            update_daily(conn, min(sent_at))
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {"conversations": len(conversations), "messages": len(messages)}
+
+
+def remove_expired(conn, include_expiring):
+    """Remove the messages which have expired, or all expiring messages if
+    `include_expiring` is False, along with their attachments.
+
+    Returns the times at which the removed messages were sent.
+    """
+    cond = "expires_at IS NOT NULL"
+    if include_expiring:
+        cond += f" AND expires_at <= {int(time.time() * 1000)}"
+
+    rows = conn.execute(f"SELECT id, sent_at FROM messages WHERE {cond}").fetchall()
+    LOGGER.debug(f"Removing {len(rows)} expired messages.")
+    conn.executemany(
+        "DELETE FROM attachments WHERE message_id = ?", ((row["id"],) for row in rows)
+    )
+    conn.execute(f"DELETE FROM messages WHERE {cond}")
+
+    return [row["sent_at"] for row in rows]
+
+
+def update_attachments(conn, messages, workers=None):
+    """Index the attachments of the synchronised messages, replacing any
+    previously indexed attachments of those messages."""
+    conn.executemany(
+        "DELETE FROM attachments WHERE message_id = ?",
+        ((row["id"],) for row in messages),
+    )
+
+    messages = [row for row in messages if row["hasAttachments"]]
+    attachments = utilities.parse_attachments(
+        (row["json"] for row in messages), workers=workers
+    )
+    LOGGER.debug(f"Indexing the attachments of {len(messages)} messages.")
+
+    conn.executemany(
+        """
+        INSERT INTO attachments
+            (message_id, position, contentType, size, path, fileName)
+        VALUES (?, ?, ?, ?, ?, ?)""",
+        (
+            (
+                row["id"],
+                position,
+                a.get("contentType"),
+                a.get("size"),
+                a.get("path"),
+                a.get("fileName"),
+            )
+            for row, atts in zip(messages, attachments)
+            for position, a in enumerate(atts)
+        ),
+    )
+
+
+def update_daily(conn, since):
+    """Recompute the daily aggregates from the (local) day of `since` (a
+    millisecond timestamp) onwards."""
+    date = "date(sent_at / 1000, 'unixepoch', 'localtime')"
+    since, start = conn.execute(
+        """
+        SELECT
+            date(? / 1000, 'unixepoch', 'localtime'),
+            strftime('%s', date(? / 1000, 'unixepoch', 'localtime'), 'utc') * 1000
+        """,
+        (since, since),
+    ).fetchone()
+    LOGGER.debug(f"Updating the daily aggregates from {since}.")
+
+    conn.execute("DELETE FROM daily WHERE date >= ?", (since,))
+    conn.execute(
+        f"""
+        INSERT INTO daily
+        SELECT
+            conversationId,
+            {date} date,
+            type,
+            expires_at IS NOT NULL expiring,
+            count(*) messages,
+            sum(length(body)) characters
+        FROM messages
+        WHERE sent_at >= ?
+        GROUP BY conversationId, {date}, type, expiring""",
+        (start,),
+    )
+
+
+@click.command(__name__.replace("_", "-"))
+@click.option(
+    "--full/--incremental",
+    default=False,
+    help="Toggle whether the analytics database is rebuilt from scratch.",
+)
+@click.pass_context
+def main(ctx, full):
+    """Synchronise the local analytics database with Signal.
+    """
+    results = profiles.run(ctx, sync, full)
+    profiles.print_summary(results)
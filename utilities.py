@@ -1,13 +1,25 @@
 """Utility functions"""
 
+import itertools
 import json
 import logging
 import os
 import shutil
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from dateutil.tz import tzlocal
 
 import db
 
+try:
+    import orjson as _fast_json
+except ImportError:
+    try:
+        import ujson as _fast_json
+    except ImportError:
+        _fast_json = json
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -25,63 +37,152 @@ def conversation_mapping(config):
     return mapping
 
 
-def parse_message_json(s):
-    """Parse a message's JSON converting (as many) fields as possible into more
-    useful types (such as integers to booleans, and integers to datetime
-    objects.)
+# Fields within a message's JSON which are stored as millisecond timestamps
+# and booleans stored as integers.
+JSON_TIMESTAMPS = [
+    "received_at",
+    "sent_at",
+    "timestamp",
+    "decrypted_at",
+    "expirationStartTimestamp",
+]
+JSON_BOOLEANS = ["hasAttachments", "hasVisualMediaAttachments"]
+
+
+def to_datetime(values):
+    """Convert millisecond timestamps into naive local datetimes.
+
+    This is the vectorised equivalent of `datetime.fromtimestamp(x / 1000)`.
     """
-    js = json.loads(s)
-
-    js["received_at"] = datetime.fromtimestamp(js["received_at"] / 1000)
-    js["sent_at"] = datetime.fromtimestamp(js["sent_at"] / 1000)
-    js["timestamp"] = datetime.fromtimestamp(js["timestamp"] / 1000)
-    if "decrypted_at" in js:
-        js["decrypted_at"] = datetime.fromtimestamp(js["decrypted_at"] / 1000)
-    if "expirationStartTimestamp" in js and js["expirationStartTimestamp"] is not None:
-        js["expirationStartTimestamp"] = datetime.fromtimestamp(
-            js["expirationStartTimestamp"] / 1000
-        )
+    values = pd.Series(values).astype("int64")
+    return (
+        pd.to_datetime(values, unit="ms", utc=True)
+        .dt.tz_convert(tzlocal())
+        .dt.tz_localize(None)
+    )
+
+
+def to_milliseconds(value):
+    """Convert a naive local datetime into a millisecond timestamp.
+
+    This is the inverse of `to_datetime`.  Ambiguous times during daylight
+    saving transitions are resolved to the earliest possible instant.
+    """
+    value = pd.Timestamp(value).tz_localize(
+        tzlocal(), ambiguous=True, nonexistent="shift_forward"
+    )
+    return int(value.timestamp() * 1000)
+
+
+def _load_json_chunk(chunk):
+    """Decode a chunk of raw JSON strings."""
+    return [_fast_json.loads(s) for s in chunk]
+
+
+def _load_attachments_chunk(chunk):
+    """Decode only the attachments from a chunk of raw JSON strings."""
+    return [_fast_json.loads(s).get("attachments") or [] for s in chunk]
 
-    js["hasAttachments"] = bool(js["hasAttachments"])
-    if "hasVisualMediaAttachments" in js:
-        js["hasVisualMediaAttachments"] = bool(js["hasVisualMediaAttachments"])
 
-    return js
+def _map_chunks(func, raw, workers, chunk_size):
+    """Apply `func` to chunks of `raw` across a pool of `workers` processes,
+    returning the concatenated results.  `func` must be a module-level
+    function so that it can be sent to the workers."""
+    raw = list(raw)
+    chunks = [raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)]
 
+    if workers == 1 or len(chunks) <= 1:
+        return list(itertools.chain.from_iterable(map(func, chunks)))
 
-def export_attachments(config, messages):
-    """Export the attachments associated with all the messages."""
+    LOGGER.debug(f"Parsing {len(raw)} messages in {len(chunks)} chunks")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(itertools.chain.from_iterable(pool.map(func, chunks)))
+
+
+def parse_attachments(raw, workers=None, chunk_size=5000):
+    """Parse the list of attachments from raw message JSON.
+
+    The decoding is distributed in the same way as `parse_messages_json`,
+    but only the attachments are returned by the workers.
+    """
+    return _map_chunks(_load_attachments_chunk, raw, workers, chunk_size)
+
+
+def parse_messages_json(raw, workers=None, chunk_size=5000):
+    """Parse a column of raw message JSON into dictionaries.
+
+    The millisecond timestamps (see `JSON_TIMESTAMPS`) are converted into
+    naive local datetimes and the integer flags (see `JSON_BOOLEANS`) into
+    booleans.  The decoding is split into chunks of `chunk_size` messages
+    which are distributed across a pool of `workers` processes (defaulting to
+    the number of CPUs).  The faster `orjson` or `ujson` decoders are used if
+    they are installed, and the timestamps are converted in a single
+    vectorised pass once all messages have been decoded.
+    """
+    parsed = _map_chunks(_load_json_chunk, raw, workers, chunk_size)
+
+    for key in JSON_TIMESTAMPS:
+        present = [js for js in parsed if js.get(key) is not None]
+        if not present:
+            continue
+        converted = to_datetime([js[key] for js in present]).dt.to_pydatetime()
+        for js, value in zip(present, converted):
+            js[key] = value
+
+    for key in JSON_BOOLEANS:
+        for js in parsed:
+            if key in js:
+                js[key] = bool(js[key])
+
+    return pd.Series(parsed, index=raw.index, dtype=object)
+
+
+def format_size(size):
+    """Format a size in bytes for display."""
+    for unit in ["B", "kB", "MB", "GB"]:
+        if size < 1000:
+            break
+        size /= 1000
+    return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+
+
+def export_attachments(config, attachments):
+    """Export the attachments listed in the attachment index (as returned by
+    `db.fetch_attachments`)."""
     LOGGER.info("Exporting all attachments.")
     conv_map = conversation_mapping(config)
-    messages = messages[messages["has_attachments"]]
-
-    for _, msg in messages.iterrows():
-        js = msg["json"]
-        for attachment in js["attachments"]:
-            if "path" not in attachment:
-                LOGGER.warning(f"{msg['id']}: Attachment does not specified a path")
-                continue
-
-            ext = attachment["contentType"].lower().split("/")[-1]
-            attachment_id = attachment["path"].split("/")[-1]
-            name = "{}.{}.{}".format(
-                msg["sent_at"].strftime("%Y-%m-%d-%H:%M:%S"), attachment_id[:8], ext
-            )
 
-            src = config["signal_dir"] / "attachments.noindex" / attachment["path"]
-            dst = (
-                config["output_dir"] / conv_map[msg["conversation_id"]] / "files" / name
-            )
-            if not src.is_file():
-                LOGGER.warning(f"Skipping {src} (file does not exist)")
-                return
-
-            if dst.is_file():
-                LOGGER.debug(f"Skipping {dst} (destination exists)")
-                return
-
-            dst.parent.mkdir(exist_ok=True)
-            shutil.copy(src, dst)
-            os.utime(
-                dst, times=(msg["sent_at"].timestamp(), msg["sent_at"].timestamp())
+    for _, attachment in attachments.iterrows():
+        if not isinstance(attachment["path"], str):
+            LOGGER.warning(
+                f"{attachment['message_id']}: Attachment does not specified a path"
             )
+            continue
+
+        ext = str(attachment["content_type"]).lower().split("/")[-1]
+        attachment_id = attachment["path"].split("/")[-1]
+        name = "{}.{}.{}".format(
+            attachment["sent_at"].strftime("%Y-%m-%d-%H:%M:%S"), attachment_id[:8], ext
+        )
+
+        src = config["signal_dir"] / "attachments.noindex" / attachment["path"]
+        dst = (
+            config["output_dir"]
+            / conv_map[attachment["conversation_id"]]
+            / "files"
+            / name
+        )
+        if not src.is_file():
+            LOGGER.warning(f"Skipping {src} (file does not exist)")
+            continue
+
+        if dst.is_file():
+            LOGGER.debug(f"Skipping {dst} (destination exists)")
+            continue
+
+        dst.parent.mkdir(exist_ok=True)
+        shutil.copy(src, dst)
+        # Naive timestamps are local times, whereas pandas would treat them as
+        # UTC.
+        timestamp = attachment["sent_at"].to_pydatetime().timestamp()
+        os.utime(dst, times=(timestamp, timestamp))
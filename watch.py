@@ -0,0 +1,101 @@
+"""Watch Signal's database for changes"""
+
+import logging
+import threading
+import time
+
+import db
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DatabaseWatcher(threading.Thread):
+    """Call `callback` whenever the database of the configured backend
+    changes.
+
+    Changes are detected with inotify if `inotify_simple` is installed, and
+    otherwise by polling the modification time and size of the database
+    files every `interval` seconds.  Bursts of changes within `debounce`
+    seconds of each other result in a single call.
+    """
+
+    def __init__(self, config, callback, interval=1.0, debounce=0.2):
+        super().__init__(name="database-watcher", daemon=True)
+        path = db.database_path(config)
+        self.directory = path.parent
+        # SQLite writes to the write-ahead log first, and only updates the
+        # main database when the log is checkpointed.
+        self.files = [path.name, f"{path.name}-wal"]
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Stop watching the database."""
+        self._stop_event.set()
+
+    def run(self):
+        if INotify is None:
+            LOGGER.info(f"Polling {self.directory} for changes.")
+            self._poll()
+        else:
+            LOGGER.info(f"Watching {self.directory} for changes with inotify.")
+            self._inotify()
+
+    def _changed(self):
+        try:
+            self.callback()
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Failed to process database change.")
+
+    def _signature(self):
+        """The modification time and size of each of the database files."""
+        signature = []
+        for name in self.files:
+            try:
+                stat = (self.directory / name).stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return signature
+
+    def _poll(self):
+        last = self._signature()
+        while not self._stop_event.wait(self.interval):
+            current = self._signature()
+            if current != last:
+                LOGGER.debug("Database changed.")
+                last = current
+                self._changed()
+
+    def _inotify(self):
+        inotify = INotify()
+        # Signal's writes always modify the database or its write-ahead log.
+        # Closing and creating files is not watched, as our own read-only
+        # queries do both and would otherwise trigger a refresh in a loop.
+        inotify.add_watch(str(self.directory), flags.MODIFY | flags.MOVED_TO)
+        timeout = int(self.interval * 1000)
+        debounce = int(self.debounce * 1000)
+
+        try:
+            while not self._stop_event.is_set():
+                events = inotify.read(timeout=timeout)
+                if not any(e.name in self.files for e in events):
+                    continue
+
+                # Wait for the burst of writes to settle, but no longer than
+                # the interval so that a busy database still gets refreshed.
+                deadline = time.monotonic() + self.interval
+                while time.monotonic() < deadline and inotify.read(timeout=debounce):
+                    pass
+
+                LOGGER.debug("Database changed.")
+                self._changed()
+        finally:
+            inotify.close()